@@ -0,0 +1,61 @@
+"""
+Recall@k and query latency of the IVF index (music/ann.py) against exact search.
+
+Songs are synthetic topic distributions drawn from a sparse Dirichlet, like the
+pLSA corpus vectors; queries are drawn the same way. Exact search is one
+matrix-vector product over the whole transformed corpus.
+
+    python benchmarks/bench_ann.py --songs 10000 100000 1000000 --probes 1 4 8 16
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from music.ann import IVFIndex, exact_search, transform  # noqa: E402
+
+
+def synthetic_topics(n_songs, n_topics, alpha=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.dirichlet(np.full(n_topics, alpha), size=n_songs).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--songs', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--topics', type=int, default=10)
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--metric', choices=['hellinger', 'cosine'], default='hellinger')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'songs':>10}{'lists':>7}{'probes':>8}{'build s':>9}{'exact ms':>10}{'ann ms':>8}{'recall@' + str(args.k):>11}")
+    for n_songs in args.songs:
+        vectors = synthetic_topics(n_songs, args.topics)
+        queries = synthetic_topics(args.queries, args.topics, seed=1)
+
+        start = time.perf_counter()
+        index = IVFIndex(metric=args.metric).build(vectors)
+        build_time = time.perf_counter() - start
+
+        X = transform(vectors, args.metric)
+        Q = transform(queries, args.metric)
+        start = time.perf_counter()
+        truth = [set(exact_search(X, q, args.k)[0].tolist()) for q in Q]
+        exact_ms = (time.perf_counter() - start) * 1000 / len(Q)
+
+        for n_probe in args.probes:
+            start = time.perf_counter()
+            found = [index.search(q, args.k, n_probe)[0] for q in queries]
+            ann_ms = (time.perf_counter() - start) * 1000 / len(Q)
+            recall = np.mean([len(truth[i].intersection(rows.tolist())) / args.k for i, rows in enumerate(found)])
+            print(f"{n_songs:>10}{index.n_lists:>7}{n_probe:>8}{build_time:>9.2f}{exact_ms:>10.3f}{ann_ms:>8.3f}{recall:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Latency and agreement of the two topic inference modes on the lyrics corpus:
+projection (X @ P(w|z), renormalized) against pLSA fold-in (EM with P(w|z)
+fixed), per batch size and iteration cap.
+
+Agreement is the share of documents whose top topic is the same in both
+modes; L1 is the mean L1 distance between their topic distributions.
+
+    python benchmarks/bench_fold_in.py --batch 1 32 322 --iterations 5 20 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from music.model import fit_vectorizer, load_model, project_topics  # noqa: E402
+from music.plsa import fold_in  # noqa: E402
+
+
+def per_batch_ms(func, X, batch_size, repeat):
+    batches = [X[start:start + batch_size] for start in range(0, X.shape[0], batch_size)]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [func(batch) for batch in batches]
+    elapsed = time.perf_counter() - start
+    return np.vstack(results), elapsed * 1000 / (repeat * len(batches))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 32, 322])
+    parser.add_argument('--iterations', type=int, nargs='+', default=[5, 20, 50])
+    parser.add_argument('--tol', type=float, default=1e-4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    vectorizer, X = fit_vectorizer()
+    P_d_z, P_w_z, P_z = load_model()
+
+    print(f"{'batch':>6}{'mode':>14}{'ms/batch':>10}{'agreement':>11}{'L1':>8}")
+    for batch_size in args.batch:
+        projected, ms = per_batch_ms(lambda batch: project_topics(batch, P_w_z), X, batch_size, args.repeat)
+        print(f"{batch_size:>6}{'projection':>14}{ms:>10.3f}{1:>11.3f}{0:>8.3f}")
+        for max_iter in args.iterations:
+            folded, ms = per_batch_ms(lambda batch: fold_in(batch, P_w_z, max_iter, args.tol), X, batch_size,
+                                      args.repeat)
+            agreement = np.mean(folded.argmax(axis=1) == projected.argmax(axis=1))
+            l1 = np.abs(folded - projected).sum(axis=1).mean()
+            print(f"{batch_size:>6}{f'fold-in {max_iter}':>14}{ms:>10.3f}{agreement:>11.3f}{l1:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Song list queries with the lyrics inline in music_song (before migration 0015)
+against lyrics in their own SongLyrics table, zlib-compressed.
+
+Builds both layouts in temporary SQLite databases with the same synthetic
+catalog, lyrics drawn from the cleaned lyrics corpus, and times the query the
+song list pages run (songs with artist and album joined, as create_playlist,
+playlist and favorites do). "Bytes fetched" is the size of every value the query
+returns; "DB MiB" is the size of the database file.
+
+    python benchmarks/bench_lyrics_storage.py --songs 10000 100000 500000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SONGS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 4
+
+SONG_COLUMNS = """
+    id integer PRIMARY KEY, song_title varchar(255), artist_id integer, album_id integer, duration bigint,
+    release_date date, genre varchar(100), mp3_file varchar(100), topic_vector blob, top_topic smallint,
+    lyrics_hash varchar(40)
+"""
+
+LIST_QUERY = """
+    SELECT song.*, artist.id, artist.name, album.id, album.album_title, album.artist_id, album.release_date,
+           album.genre, album.album_cover
+    FROM music_song song
+    INNER JOIN music_artist artist ON song.artist_id = artist.id
+    LEFT OUTER JOIN music_album album ON song.album_id = album.id
+"""
+
+
+def corpus_lyrics():
+    with open(os.path.join(BASE_DIR, 'music', 'models', 'all_cleaned_lyrics.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build(path, n_songs, lyrics_list, split):
+    connection = sqlite3.connect(path)
+    lyrics_column = '' if split else ', lyrics text'
+    connection.executescript(f"""
+        CREATE TABLE music_artist (id integer PRIMARY KEY, name varchar(255));
+        CREATE TABLE music_album (id integer PRIMARY KEY, album_title varchar(255), artist_id integer,
+                                  release_date date, genre varchar(100), album_cover varchar(100));
+        CREATE TABLE music_song ({SONG_COLUMNS}{lyrics_column});
+        CREATE TABLE music_songlyrics (song_id integer PRIMARY KEY, data blob, compressed bool);
+    """)
+    n_albums = n_songs // SONGS_PER_ALBUM + 1
+    n_artists = n_albums // ALBUMS_PER_ARTIST + 1
+    connection.executemany("INSERT INTO music_artist VALUES (?, ?)",
+                           ((i, f'Artist {i}') for i in range(n_artists)))
+    connection.executemany("INSERT INTO music_album VALUES (?, ?, ?, '2020-01-01', 'Pop', '')",
+                           ((i, f'Album {i}', i // ALBUMS_PER_ARTIST) for i in range(n_albums)))
+
+    def songs():
+        for i in range(n_songs):
+            album = i // SONGS_PER_ALBUM
+            row = (i, f'Song {i}', album // ALBUMS_PER_ARTIST, album, 210_000_000, '2020-01-01', 'Pop', '',
+                   bytes(40), 1, 'f' * 40)
+            yield row if split else row + (lyrics_list[i % len(lyrics_list)],)
+
+    placeholders = ', '.join('?' * (11 if split else 12))
+    connection.executemany(f"INSERT INTO music_song VALUES ({placeholders})", songs())
+    if split:
+        connection.executemany("INSERT INTO music_songlyrics VALUES (?, ?, 1)", (
+            (i, zlib.compress(lyrics_list[i % len(lyrics_list)].encode('utf-8'), 6)) for i in range(n_songs)))
+    connection.commit()
+    connection.execute("VACUUM")
+    return connection
+
+
+def value_size(value):
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return 8
+
+
+def bytes_fetched(connection):
+    return sum(value_size(value) for row in connection.execute(LIST_QUERY) for value in row)
+
+
+def time_list_query(connection):
+    start = time.perf_counter()
+    rows = 0
+    for row in connection.execute(LIST_QUERY):
+        rows += 1
+    return rows, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--songs', type=int, nargs='+', default=[10_000, 100_000, 500_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lyrics_list = corpus_lyrics()
+    print(f"{'songs':>9}{'layout':>8}{'bytes fetched':>15}{'rows/s':>12}{'query ms':>10}{'DB MiB':>9}")
+    for n_songs in args.songs:
+        with tempfile.TemporaryDirectory() as directory:
+            for layout, split in [('inline', False), ('split', True)]:
+                path = os.path.join(directory, f'{layout}.sqlite3')
+                connection = build(path, n_songs, lyrics_list, split)
+                fetched = bytes_fetched(connection)  # Also warms the page cache
+                rows, elapsed = min((time_list_query(connection) for _ in range(args.repeat)),
+                                    key=lambda result: result[1])
+                connection.close()
+                print(f"{n_songs:>9}{layout:>8}{fetched:>15,}{rows / elapsed:>12,.0f}{elapsed * 1000:>10.1f}"
+                      f"{os.path.getsize(path) / 2 ** 20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Load time and memory of the pLSA model formats: the legacy plsa_model.pkl
+against the artifact format (float32, and float32 with an 8-bit P_w_z).
+
+Each load runs in a fresh process. "RSS after load" is what the process holds
+right after load_model; "after use" adds one pass over every array, which is
+when memory-mapped pages are actually read (and shared between workers).
+Synthetic models of a larger vocabulary show how the formats scale.
+
+    python benchmarks/bench_model_load.py --words 3017 100000 --topics 10 50
+"""
+import argparse
+import os
+import pickle
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web.settings')
+
+
+def rss_mib():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def run(filename):
+    import django
+
+    django.setup()
+    from music.model import load_model
+
+    baseline = rss_mib()
+    start = time.perf_counter()
+    model = load_model(filename)
+    elapsed = time.perf_counter() - start
+    loaded = rss_mib()
+    checksum = sum(float(np.asarray(P).sum()) for P in model)
+    return elapsed * 1000, loaded - baseline, rss_mib() - baseline, checksum
+
+
+def write_formats(directory, model, vocabulary):
+    import django
+
+    django.setup()
+    from music.model import save_model
+
+    with open(os.path.join(directory, 'model.pkl'), 'wb') as f:
+        pickle.dump(model, f)
+    save_model(model, vocabulary, os.path.join(directory, 'float32'))
+    save_model(model, vocabulary, os.path.join(directory, 'quantized'), quantize=True)
+
+
+def synthetic_model(n_docs, n_words, n_topics, seed=0):
+    rng = np.random.default_rng(seed)
+    P_d_z, P_w_z = rng.random((n_docs, n_topics)), rng.random((n_words, n_topics))
+    P_d_z /= P_d_z.sum(axis=0)
+    P_w_z /= P_w_z.sum(axis=0)
+    return P_d_z, P_w_z, np.full(n_topics, 1 / n_topics)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, nargs='+', default=[3017, 100_000])
+    parser.add_argument('--topics', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--docs', type=int, default=322)
+    args = parser.parse_args()
+
+    print(f"{'words':>8}{'topics':>7}{'format':>11}{'load ms':>9}{'RSS after load':>16}{'after use':>11}{'disk MiB':>10}")
+    for n_words in args.words:
+        for n_topics in args.topics:
+            model = synthetic_model(args.docs, n_words, n_topics)
+            with tempfile.TemporaryDirectory() as directory:
+                write_formats(directory, model, [f'w{i}' for i in range(n_words)])
+                for label, name in [('pickle', 'model.pkl'), ('float32', 'float32'), ('quantized', 'quantized')]:
+                    path = os.path.join(directory, name)
+                    size = os.path.getsize(path) if os.path.isfile(path) else sum(
+                        os.path.getsize(os.path.join(path, entry)) for entry in os.listdir(path))
+                    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                        load_ms, loaded, used, checksum = pool.submit(run, path).result()
+                    print(f"{n_words:>8}{n_topics:>7}{label:>11}{load_ms:>9.2f}{loaded:>12.1f} MiB"
+                          f"{used:>7.1f} MiB{size / 2 ** 20:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Lyrics preprocessing throughput in tokens/sec: the original NLTK pipeline
+against music.preprocessing, serially and over a process pool.
+
+    python benchmarks/bench_preprocessing.py --repeat 20 --processes 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from music.preprocessing import preprocess_lyrics, preprocess_many, stem  # noqa: E402
+from music.tests import corpus_lyrics, legacy_preprocess_lyrics  # noqa: E402
+
+
+def timed(label, n_tokens, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28}{elapsed:>10.3f}s{n_tokens / elapsed:>16,.0f} tokens/sec")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10, help="Copies of the lyrics corpus to process")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    lyrics_list = corpus_lyrics() * args.repeat
+    n_tokens = sum(len(lyrics.split()) for lyrics in lyrics_list)
+    print(f"{len(lyrics_list)} lyrics, {n_tokens:,} tokens")
+
+    legacy = timed("legacy (word_tokenize)", n_tokens, lambda: [legacy_preprocess_lyrics(x) for x in lyrics_list])
+    stem.cache_clear()
+    fast = timed("preprocess_lyrics", n_tokens, lambda: [preprocess_lyrics(x) for x in lyrics_list])
+    timed("preprocess_lyrics (warm)", n_tokens, lambda: [preprocess_lyrics(x) for x in lyrics_list])
+    pooled = timed(f"preprocess_many x{args.processes}", n_tokens,
+                   lambda: preprocess_many(lyrics_list, processes=args.processes))
+    print(f"stem cache: {stem.cache_info()}")
+    assert legacy == fast == pooled, "preprocessing output differs from the legacy pipeline"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Peak RSS of the corpus topic projection against vocabulary size.
+
+Each configuration runs in a fresh process so ru_maxrss only reflects that run.
+The dense path is the old `X_corpus.toarray() @ P_w_z`; the sparse path is
+music.model.project_topics.
+
+    python benchmarks/bench_projection_memory.py --docs 20000 --topics 10
+"""
+import argparse
+import os
+import resource
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from scipy import sparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_corpus(n_docs, n_words, n_topics, words_per_doc=80, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(n_docs), words_per_doc)
+    cols = rng.integers(0, n_words, size=n_docs * words_per_doc)
+    X = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_docs, n_words))
+    P_w_z = rng.random((n_words, n_topics))
+    P_w_z /= P_w_z.sum(axis=0, keepdims=True)
+    return X, P_w_z
+
+
+def run(mode, n_docs, n_words, n_topics):
+    from music.model import normalize_rows, project_topics
+
+    X, P_w_z = synthetic_corpus(n_docs, n_words, n_topics)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if mode == 'dense':
+        P_z_corpus = normalize_rows(np.dot(X.toarray(), P_w_z))
+    else:
+        P_z_corpus = project_topics(X, P_w_z)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    return P_z_corpus.shape, baseline / 1024, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--topics', type=int, default=10)
+    parser.add_argument('--vocab', type=int, nargs='+', default=[1000, 5000, 20000, 50000])
+    parser.add_argument('--skip-dense', action='store_true', help="Only run the sparse path")
+    args = parser.parse_args()
+
+    modes = ['sparse'] if args.skip_dense else ['dense', 'sparse']
+    print(f"{'mode':<8}{'vocab':>10}{'baseline MiB':>15}{'peak MiB':>12}{'delta MiB':>12}")
+    for n_words in args.vocab:
+        for mode in modes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                shape, baseline, peak = pool.submit(run, mode, args.docs, n_words, args.topics).result()
+            print(f"{mode:<8}{n_words:>10}{baseline:>15.1f}{peak:>12.1f}{peak - baseline:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
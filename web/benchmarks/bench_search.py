@@ -0,0 +1,127 @@
+"""
+Song search latency: the FTS5 index (music/search.py, migration 0016) against
+the substring LIKE scan it replaces, on synthetic catalogs.
+
+Titles, artist and album names are built from words of the lyrics corpus;
+queries are 1-2 word prefixes of 2-6 characters drawn from the same words, so
+common prefixes match many thousands of songs (2-character words only match
+whole words, see PREFIX_MIN_LENGTH). With --lyrics every song also
+gets lyrics from the corpus in the index.
+
+    python benchmarks/bench_search.py --songs 100000 1000000
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'web.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from music.search import COLUMN_WEIGHTS, SEARCH_DEFAULT_LIMIT, SEARCH_TABLE, match_expression  # noqa: E402
+
+CREATE_SEARCH_TABLE = importlib.import_module('music.migrations.0016_songsearch').CREATE_SEARCH_TABLE
+
+SONGS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 4
+
+
+def corpus_lyrics():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'music', 'models', 'all_cleaned_lyrics.json')
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build(path, n_songs, words, lyrics_list, rng):
+    def name(n_words):
+        return ' '.join(rng.choice(words) for _ in range(n_words)).title()
+
+    artists = [name(2) for _ in range(n_songs // (SONGS_PER_ALBUM * ALBUMS_PER_ARTIST) + 1)]
+    albums = [name(3) for _ in range(n_songs // SONGS_PER_ALBUM + 1)]
+
+    def rows():
+        for i in range(n_songs):
+            album = i // SONGS_PER_ALBUM
+            lyrics = lyrics_list[i % len(lyrics_list)] if lyrics_list else ''
+            yield i + 1, name(rng.randint(1, 4)), artists[album // ALBUMS_PER_ARTIST], albums[album], lyrics
+
+    connection = sqlite3.connect(path)
+    connection.execute(CREATE_SEARCH_TABLE)
+    connection.execute("CREATE TABLE songs (id integer PRIMARY KEY, title text, artist text, album text)")
+    for row in rows():
+        connection.execute(f"INSERT INTO {SEARCH_TABLE} (rowid, title, artist, album, lyrics) VALUES (?, ?, ?, ?, ?)",
+                           row)
+        connection.execute("INSERT INTO songs VALUES (?, ?, ?, ?)", row[:4])
+    connection.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    connection.commit()
+    return connection
+
+
+def fts_search(connection, terms, lyrics):
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS.values())
+    return connection.execute(
+        f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH ? "
+        f"ORDER BY bm25({SEARCH_TABLE}, {weights}), rowid LIMIT ?",
+        [match_expression(terms, lyrics), SEARCH_DEFAULT_LIMIT]).fetchall()
+
+
+def like_search(connection, terms):
+    # What an unindexed substring search over the same fields costs
+    conditions = ' AND '.join('(title LIKE ? OR artist LIKE ? OR album LIKE ?)' for _ in terms)
+    params = [f'%{term}%' for term in terms for _ in range(3)]
+    return connection.execute(f"SELECT id FROM songs WHERE {conditions} ORDER BY title LIMIT ?",
+                              params + [SEARCH_DEFAULT_LIMIT]).fetchall()
+
+
+def timed(function, queries):
+    latencies = []
+    for terms in queries:
+        start = time.perf_counter()
+        function(terms)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--songs', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--like-queries', type=int, default=20, help="LIKE scans are slow, time fewer of them")
+    parser.add_argument('--lyrics', action='store_true', help="Index lyrics and search them too")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    lyrics_list = corpus_lyrics()
+    words = sorted({word for lyrics in lyrics_list for word in lyrics.split() if len(word) > 2})
+    queries = [[rng.choice(words)[:rng.randint(2, 6)] for _ in range(rng.randint(1, 2))] for _ in range(args.queries)]
+
+    print(f"{'songs':>9}{'build s':>9}{'DB MiB':>8}{'search':>8}{'p50 ms':>9}{'p95 ms':>9}")
+    for n_songs in args.songs:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'search.sqlite3')
+            start = time.perf_counter()
+            connection = build(path, n_songs, words, lyrics_list if args.lyrics else None, rng)
+            build_time = time.perf_counter() - start
+            size = os.path.getsize(path) / 2 ** 20
+
+            results = [('fts5', timed(lambda terms: fts_search(connection, terms, args.lyrics), queries)),
+                       ('like', timed(lambda terms: like_search(connection, terms), queries[:args.like_queries]))]
+            for label, (p50, p95) in results:
+                print(f"{n_songs:>9}{build_time:>9.1f}{size:>8.0f}{label:>8}{p50:>9.2f}{p95:>9.2f}")
+            connection.close()
+
+
+if __name__ == '__main__':
+    main()
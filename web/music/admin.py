@@ -1,3 +1,4 @@
+from django import forms
 from django.contrib import admin
 from .models import Artist, Album, Song, User, Playlist
 
@@ -21,9 +22,29 @@ class AlbumAdmin(admin.ModelAdmin):
     search_fields = ('album_title', 'artist__name')
 
 
+# Lyrics are stored in SongLyrics, edited on the song through Song.lyrics
+class SongAdminForm(forms.ModelForm):
+    lyrics = forms.CharField(widget=forms.Textarea, required=False)
+
+    class Meta:
+        model = Song
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['lyrics'].initial = self.instance.lyrics
+
+    def save(self, commit=True):
+        if self.cleaned_data['lyrics'] != (self.instance.lyrics or ''):
+            self.instance.lyrics = self.cleaned_data['lyrics'] or None
+        return super().save(commit)
+
+
 @admin.register(Song)
 class SongAdmin(admin.ModelAdmin):
-    list_display = ('song_title', 'artist', 'album', 'duration', 'release_date', 'genre')  # Include genre
+    form = SongAdminForm
+    list_display = ('song_title', 'artist', 'album', 'duration', 'release_date', 'genre', 'top_topic')  # Include genre
     list_filter = ('artist', 'album', 'genre')  # Filter by genre
     search_fields = ('song_title', 'artist__name', 'album__album_title', 'genre')  # Search by genre
 
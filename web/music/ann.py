@@ -0,0 +1,138 @@
+# Approximate nearest neighbours over song topic vectors
+import json
+import os
+
+import numpy as np
+
+
+METRICS = ('hellinger', 'cosine')
+
+
+def transform(vectors, metric='hellinger'):
+    """
+    Map topic vectors so that similarity is a plain inner product.
+
+    hellinger: square roots of the normalized distributions. They have unit length,
+               so the inner product is the Bhattacharyya coefficient, 1 - H^2.
+    cosine:    L2-normalized vectors.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    if metric == 'hellinger':
+        vectors = np.clip(vectors, 0, None)
+        sums = vectors.sum(axis=1, keepdims=True)
+        sums[sums == 0] = 1
+        return np.sqrt(vectors / sums)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """Positions of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+def exact_search(X, query, k=20):
+    """Brute-force top k rows of the transformed matrix X for one transformed query."""
+    scores = X @ query
+    best = top_k(scores, k)
+    return best, scores[best]
+
+
+def assign(X, centroids, batch_size=65536):
+    labels = np.empty(len(X), dtype=np.int32)
+    for start in range(0, len(X), batch_size):
+        labels[start:start + batch_size] = np.argmax(X[start:start + batch_size] @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(X, n_clusters, n_iter=10, sample_size=100_000, seed=0):
+    """Lloyd iterations on unit vectors (centroids renormalized), trained on a random sample of X."""
+    rng = np.random.default_rng(seed)
+    sample = X[rng.choice(len(X), min(sample_size, len(X)), replace=False)]
+    n_clusters = min(n_clusters, len(sample))
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(sample, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.stack([np.bincount(labels, weights=sample[:, dim], minlength=n_clusters)
+                         for dim in range(X.shape[1])], axis=1)
+        # Reseed empty clusters from random points
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index: the vectors are partitioned by spherical k-means and a
+    query only scans the n_probe partitions whose centroids are closest to it.
+
+    Knobs: n_lists (more lists, smaller scans), n_probe (more probes, better
+    recall, slower), n_iter and sample_size for training.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, metric='hellinger', n_iter=10, sample_size=100_000, seed=0):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.metric = metric
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+        self.meta = {}
+
+    def build(self, vectors):
+        X = transform(vectors, self.metric)
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(X))))
+        self.centroids = spherical_kmeans(X, n_lists, self.n_iter, self.sample_size, self.seed)
+        self.n_lists = len(self.centroids)
+
+        # Store the vectors grouped by list so each probe scans a contiguous block
+        labels = assign(X, self.centroids)
+        self.order = np.argsort(labels, kind='stable').astype(np.int32)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=self.n_lists))])
+        self.vectors = X[self.order]
+        return self
+
+    def __len__(self):
+        return len(self.order)
+
+    def search(self, query, k=20, n_probe=None):
+        """Top k rows for one query vector, best first, as (rows, similarities)."""
+        q = transform(query, self.metric)[0]
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probes = top_k(self.centroids @ q, n_probe)
+        positions = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes])
+        scores = self.vectors[positions] @ q
+        best = top_k(scores, k)
+        return self.order[positions[best]], scores[best]
+
+    def save(self, path, **meta):
+        """Write the index as a directory of .npy files plus a JSON header; extra meta is stored with it."""
+        os.makedirs(path, exist_ok=True)
+        for name in ('centroids', 'order', 'offsets', 'vectors'):
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        self.meta = dict(meta, metric=self.metric, n_probe=self.n_probe, n_lists=self.n_lists, rows=len(self))
+        with open(os.path.join(path, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, 'index.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(n_lists=meta['n_lists'], n_probe=meta['n_probe'], metric=meta['metric'])
+        for name in ('centroids', 'order', 'offsets', 'vectors'):
+            setattr(index, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode))
+        index.meta = meta
+        return index
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class MusicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'music'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Build the recommender engine up front instead of on the first request
+        if getattr(settings, 'RECOMMENDER_PRELOAD', False):
+            from .model import get_engine
+            get_engine()
@@ -0,0 +1,56 @@
+# Cached catalog reads
+import time
+from itertools import groupby
+from operator import attrgetter
+
+from django.core.cache import caches
+
+from .models import Album
+
+
+# Cache alias holding catalog reads, see CACHES in settings
+CATALOG_CACHE_ALIAS = 'default'
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def catalog_cache():
+    return caches[CATALOG_CACHE_ALIAS]
+
+
+def catalog_version():
+    """
+    Current catalog version. Every cached catalog read is keyed on it, so bumping
+    it (see signals.py) retires them all at once; old entries simply age out.
+    """
+    cache = catalog_cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock, never from a number an evicted version key already used
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = catalog_cache()
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def albums_by_genre():
+    """Genre -> albums (with their artist) for the homepage, built once per catalog version."""
+    cache = catalog_cache()
+    key = f'catalog:albums-by-genre:{catalog_version()}'
+    albums_by_genre = cache.get(key)
+    if albums_by_genre is None:
+        # Only the fields the album cards show
+        albums = (Album.objects.select_related('artist')
+                  .only('id', 'album_title', 'genre', 'album_cover', 'artist__name')
+                  .order_by('genre', 'id'))
+        albums_by_genre = {genre: list(albums_in_genre)
+                           for genre, albums_in_genre in groupby(albums, key=attrgetter('genre'))}
+        cache.set(key, albums_by_genre, timeout=None)
+    return albums_by_genre
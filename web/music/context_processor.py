@@ -1,11 +1,12 @@
-from .models import Playlist
-
 def user_playlists(request):
-    if request.user.is_authenticated:
-        playlists = Playlist.objects.filter(user=request.user)
+    # Read from the request's UserState, shared with the views (see middleware.py)
+    user_state = getattr(request, 'user_state', None)
+    if user_state is not None and request.user.is_authenticated:
+        playlists = user_state.playlists
     else:
         playlists = None
 
     return {
         'playlists': playlists,
+        'user_state': user_state,
     }
@@ -0,0 +1,176 @@
+# Streaming lyrics corpus
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+from .model import CORPUS_MAX_DF, CORPUS_MIN_DF, _atomic_save, artifact_path, corpus_stop_words
+from .preprocessing import preprocess_many
+
+
+class StreamingCorpus:
+    """
+    Document-term counts of a growing corpus, with the same tokens and
+    min_df/max_df vocabulary as fit_vectorizer's CountVectorizer, but without
+    refitting over every document when some are added.
+
+    Every term ever seen gets a permanent id and a document frequency; rows are
+    stored against those ids, so adding N documents only touches their terms.
+    The vocabulary (the terms passing the cutoffs, sorted like CountVectorizer's)
+    is re-indexed only when some term actually crosses a cutoff.
+    """
+
+    def __init__(self, min_df=CORPUS_MIN_DF, max_df=CORPUS_MAX_DF, stop_words=None):
+        if not isinstance(min_df, int):
+            # A proportional min_df would rise with the corpus and could drop any term
+            raise ValueError("StreamingCorpus needs an absolute (int) min_df")
+        self.min_df = min_df
+        self.max_df = max_df
+        self.stop_words = sorted(stop_words if stop_words is not None else corpus_stop_words())
+        self.analyzer = CountVectorizer(stop_words=self.stop_words).build_analyzer()
+
+        self.terms = []
+        self.term_ids = {}
+        self.df = []
+        self.kept = []
+        self.keys = []
+        self.n_docs = 0
+        # Terms currently over max_df; the only excluded terms a larger corpus can bring back
+        self.too_frequent = set()
+        self.vocabulary = []
+        self.vocabulary_version = 0
+        self._blocks = []
+
+    def max_doc_count(self):
+        return self.max_df if isinstance(self.max_df, int) else self.max_df * self.n_docs
+
+    def add(self, documents, keys=None):
+        """Append preprocessed documents (and their keys). Returns True if the vocabulary changed."""
+        documents = list(documents)
+        indptr, indices, data = [0], [], []
+        touched = set()
+        for document in documents:
+            for term, count in Counter(self.analyzer(document)).items():
+                term_id = self.term_ids.get(term)
+                if term_id is None:
+                    term_id = self.term_ids[term] = len(self.terms)
+                    self.terms.append(term)
+                    self.df.append(0)
+                    self.kept.append(False)
+                self.df[term_id] += 1
+                touched.add(term_id)
+                indices.append(term_id)
+                data.append(count)
+            indptr.append(len(indices))
+        self._blocks.append((np.array(indptr), np.array(indices, dtype=np.int64), np.array(data, dtype=np.int64)))
+        self.keys.extend(keys if keys is not None else [''] * len(documents))
+        self.n_docs += len(documents)
+
+        # Document frequencies only grow and the max_df threshold only rises, so a
+        # term can only cross a cutoff if it was touched or was over max_df
+        changed = False
+        high = self.max_doc_count()
+        for term_id in touched | self.too_frequent:
+            df = self.df[term_id]
+            keep = self.min_df <= df <= high
+            if keep != self.kept[term_id]:
+                self.kept[term_id] = keep
+                changed = True
+            if df > high:
+                self.too_frequent.add(term_id)
+            else:
+                self.too_frequent.discard(term_id)
+        if changed:
+            self.vocabulary = sorted(term for term, keep in zip(self.terms, self.kept) if keep)
+            self.vocabulary_version += 1
+        return changed
+
+    def rows(self):
+        """All rows as a CSR matrix over the permanent term ids."""
+        if len(self._blocks) > 1:
+            indptr = [self._blocks[0][0]]
+            for block_indptr, indices, data in self._blocks[1:]:
+                indptr.append(block_indptr[1:] + indptr[-1][-1])
+            self._blocks = [(np.concatenate(indptr),
+                             np.concatenate([block[1] for block in self._blocks]),
+                             np.concatenate([block[2] for block in self._blocks]))]
+        indptr, indices, data = self._blocks[0] if self._blocks else (np.zeros(1, dtype=np.int64), [], [])
+        return sparse.csr_matrix((data, indices, indptr), shape=(self.n_docs, len(self.terms)), dtype=np.int64)
+
+    def matrix(self, vocabulary=None):
+        """
+        The document-term matrix over a vocabulary, by default the corpus' own; terms
+        of another vocabulary (e.g. the one P_w_z was trained on) that were never seen
+        get empty columns.
+        """
+        vocabulary = self.vocabulary if vocabulary is None else list(vocabulary)
+        columns = np.array([self.term_ids.get(term, -1) for term in vocabulary], dtype=np.int64)
+        seen = np.flatnonzero(columns >= 0)
+        selection = sparse.csr_matrix((np.ones(len(seen), dtype=np.int64), (columns[seen], seen)),
+                                      shape=(len(self.terms), len(vocabulary)))
+        X = (self.rows() @ selection).tocsr()
+        X.sort_indices()
+        return X
+
+    def save(self, path):
+        """Write the corpus as one .npz (path or file object)."""
+        rows = self.rows()
+        np.savez(path, terms=np.array(self.terms, dtype=str), df=np.array(self.df, dtype=np.int64),
+                 keys=np.array(self.keys, dtype=str), indptr=rows.indptr, indices=rows.indices, data=rows.data,
+                 stop_words=np.array(self.stop_words, dtype=str), min_df=self.min_df, max_df=self.max_df)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            max_df = saved['max_df'].item()
+            corpus = cls(int(saved['min_df']), max_df, saved['stop_words'].tolist())
+            corpus.terms = saved['terms'].tolist()
+            corpus.df = saved['df'].tolist()
+            corpus.keys = saved['keys'].tolist()
+            corpus._blocks = [(saved['indptr'], saved['indices'].astype(np.int64), saved['data'].astype(np.int64))]
+        corpus.term_ids = {term: term_id for term_id, term in enumerate(corpus.terms)}
+        corpus.n_docs = len(corpus.keys)
+        high = corpus.max_doc_count()
+        corpus.kept = [corpus.min_df <= df <= high for df in corpus.df]
+        corpus.too_frequent = {term_id for term_id, df in enumerate(corpus.df) if df > high}
+        corpus.vocabulary = sorted(term for term, keep in zip(corpus.terms, corpus.kept) if keep)
+        return corpus
+
+
+def update_catalog_corpus(rebuild=False, processes=1):
+    """
+    Bring the stored catalog corpus up to date, preprocessing only songs it has not
+    seen. Rows are keyed "song id:lyrics hash"; if a stored song was edited or
+    deleted the corpus is rebuilt, since document frequencies cannot be taken back.
+
+    Returns (corpus, songs added, whether the vocabulary changed, whether it was rebuilt).
+    """
+    from .models import Song, SongLyrics
+
+    path = artifact_path('corpus.npz')
+    songs = Song.objects.filter(lyrics_storage__isnull=False).order_by('id')
+    keys = {song_id: f'{song_id}:{lyrics_hash}' for song_id, lyrics_hash in songs.values_list('id', 'lyrics_hash')}
+
+    corpus = None
+    if not rebuild:
+        try:
+            corpus = StreamingCorpus.load(path)
+        except (FileNotFoundError, KeyError):
+            # Missing, or saved without document frequencies and cutoffs: start over
+            pass
+    if corpus is not None and not set(corpus.keys) <= set(keys.values()):
+        corpus = None
+    rebuilt = corpus is None
+    if corpus is None:
+        corpus = StreamingCorpus()
+
+    known = set(corpus.keys)
+    new_ids = [song_id for song_id, key in keys.items() if key not in known]
+    lyrics = [(song_lyrics.song_id, song_lyrics.text)
+              for song_lyrics in SongLyrics.objects.filter(song_id__in=new_ids).order_by('song_id')]
+    new_ids, new_lyrics = zip(*lyrics) if new_ids else ((), ())
+    changed = corpus.add(preprocess_many(list(new_lyrics), processes), [keys[song_id] for song_id in new_ids])
+    if new_ids or rebuilt:
+        _atomic_save(path, corpus.save)
+    return corpus, len(new_ids), changed, rebuilt
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from music.model import RecommenderEngine
+from music.models import Song
+
+
+class Command(BaseCommand):
+    help = "Compute the stored pLSA topic vector of every song with the model in music/models/plsa, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--processes', type=int, default=1,
+                            help="Worker processes used to preprocess each batch of lyrics")
+        parser.add_argument('--all', action='store_true',
+                            help="Recompute every song, not only those without a vector")
+
+    def handle(self, *args, **options):
+        # The model in MODEL_DIR, which train_plsa may have replaced since the release being served
+        engine = RecommenderEngine()
+        songs = Song.objects.order_by('id').select_related('lyrics_storage').only('id', 'lyrics_hash', 'lyrics_storage')
+        if not options['all']:
+            songs = songs.filter(topic_vector=None)
+
+        batch_size = options['batch_size']
+        updated = 0
+        last_id = 0
+        while True:
+            # Page by primary key so updated rows never shift the next batch
+            batch = list(songs.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            with_lyrics = [song for song in batch if song.lyrics]
+            vectors = engine.topic_vectors([song.lyrics for song in with_lyrics], options['processes']) \
+                if with_lyrics else []
+            for song, P_z in zip(with_lyrics, vectors):
+                song.set_topic_distribution(P_z)
+            for song in batch:
+                if not song.lyrics:
+                    song.set_topic_distribution(None)
+
+            Song.objects.bulk_update(batch, Song.TOPIC_FIELDS)
+            updated += len(batch)
+            self.stdout.write(f"{updated} songs updated")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {updated} topic vectors. Run `manage.py build_recommender` to rebuild the corpus."
+        ))
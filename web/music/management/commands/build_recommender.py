@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from music.model import build_artifacts
+
+
+class Command(BaseCommand):
+    help = ("Fit the recommender corpus once and write the model, vocabulary, topic matrix and song index "
+            "as a new release, then make it current.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ann', action='store_true', default=None,
+                            help="Always build the ANN index (default: only past RECOMMENDER_ANN_MIN_ROWS songs).")
+        parser.add_argument('--no-ann', dest='ann', action='store_false', help="Never build the ANN index.")
+        parser.add_argument('--no-publish', dest='publish', action='store_false',
+                            help="Write the release without making it current.")
+
+    def handle(self, *args, **options):
+        release, (n_songs, n_topics) = build_artifacts(ann=options['ann'], publish=options['publish'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Built recommender release {release}: {n_songs} songs, {n_topics} topics"
+            f"{'' if options['publish'] else ' (not published)'}."
+        ))
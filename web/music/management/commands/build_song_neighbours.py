@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from music.neighbours import NEIGHBOURS_PER_SONG, build_neighbours
+
+
+class Command(BaseCommand):
+    help = "Compute the nearest songs of every song from the stored topic vectors, for the lyrics page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', type=int, default=NEIGHBOURS_PER_SONG, help="Neighbours kept per song")
+        parser.add_argument('--changed', action='store_true',
+                            help="Only recompute songs whose topic vector changed since the last build")
+
+    def handle(self, *args, **options):
+        recomputed, total = build_neighbours(options['k'], changed_only=options['changed'])
+        self.stdout.write(self.style.SUCCESS(f"Recomputed neighbours for {recomputed} of {total} songs."))
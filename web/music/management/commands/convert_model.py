@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from music.model import MODEL_DIR, fit_vectorizer, load_model, save_model
+
+
+class Command(BaseCommand):
+    help = "Convert a pickled pLSA model (plsa_model.pkl) to the memory-mappable artifact format."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', default='plsa_model.pkl', help="Pickle file in music/models")
+        parser.add_argument('--output', default=MODEL_DIR, help="Model directory in music/models")
+        parser.add_argument('--quantize', action='store_true',
+                            help="Store P_w_z as 8-bit integers (smaller files, loaded as float32)")
+        parser.add_argument('--float64', action='store_true', help="Keep float64 instead of float32")
+
+    def handle(self, *args, **options):
+        model = load_model(options['input'])
+        # The pickle does not carry its vocabulary; its P_w_z rows follow the corpus vectorizer's
+        vectorizer, X = fit_vectorizer()
+        if model[1].shape[0] != len(vectorizer.vocabulary_):
+            self.stderr.write(f"P_w_z has {model[1].shape[0]} rows but the corpus vocabulary has "
+                              f"{len(vectorizer.vocabulary_)} terms.")
+            return
+        manifest = save_model(model, vectorizer.get_feature_names_out(), options['output'], options['quantize'],
+                              'float64' if options['float64'] else 'float32')
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['output']}: {manifest['topics']} topics, "
+            f"{'quantized ' if manifest['quantized'] else ''}P_w_z."
+        ))
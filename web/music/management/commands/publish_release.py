@@ -0,0 +1,26 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music.model import RELEASES_DIR, current_release, model_path, publish_release, release_path
+
+
+class Command(BaseCommand):
+    help = "Make a recommender release current (e.g. to roll back), or list the releases."
+
+    def add_arguments(self, parser):
+        parser.add_argument('release', nargs='?', help="Release directory name; omit to list releases")
+
+    def handle(self, *args, **options):
+        release = options['release']
+        if release is None:
+            current = current_release()
+            releases_dir = model_path(RELEASES_DIR)
+            for entry in sorted(os.listdir(releases_dir)) if os.path.isdir(releases_dir) else []:
+                if os.path.isdir(release_path(entry)) and not entry.endswith('.tmp'):
+                    self.stdout.write(f"{'*' if entry == current else ' '} {entry}")
+            return
+        if not os.path.isdir(release_path(release)):
+            raise CommandError(f"No release named {release}")
+        publish_release(release)
+        self.stdout.write(self.style.SUCCESS(f"{release} is now current."))
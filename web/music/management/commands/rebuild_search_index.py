@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from music.search import rebuild_index, search_available
+
+
+class Command(BaseCommand):
+    help = "Rebuild the song search index from the whole catalog (after bulk imports or a SEARCH_INDEX_LYRICS change)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not search_available():
+            raise CommandError("The search index needs SQLite with FTS5; other databases search by substring.")
+        indexed = rebuild_index(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} songs."))
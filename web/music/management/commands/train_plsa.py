@@ -0,0 +1,48 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from music.corpus import update_catalog_corpus
+from music.model import MODEL_DIR, fit_vectorizer, load_model, save_model
+from music.plsa import train
+
+
+class Command(BaseCommand):
+    help = "Train the pLSA model by EM and write it in the artifact format (P_d_z, P_w_z, P_z and a manifest)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topics', type=int, default=10)
+        parser.add_argument('--iterations', type=int, default=100, help="Maximum number of EM iterations")
+        parser.add_argument('--tol', type=float, default=1e-5,
+                            help="Stop once the relative log-likelihood gain is below this")
+        parser.add_argument('--warm-start', nargs='?', const='', default=None, metavar='FILENAME',
+                            help="Start from an existing model in music/models, a directory or a .pkl file "
+                                 "(default: the model being served)")
+        parser.add_argument('--source', choices=['catalog', 'json'], default='catalog',
+                            help="Train on the catalog lyrics or on all_cleaned_lyrics.json")
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes for preprocessing and the E-step")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=MODEL_DIR, help="Model directory in music/models")
+        parser.add_argument('--quantize', action='store_true',
+                            help="Store P_w_z as 8-bit integers (smaller files, loaded as float32)")
+
+    def handle(self, *args, **options):
+        # The vocabulary stays the one of all_cleaned_lyrics.json, so P_w_z rows line up with the engine's
+        vectorizer, X = fit_vectorizer()
+        if options['source'] == 'catalog':
+            # Only songs added since the last run are preprocessed
+            corpus, added, changed, rebuilt = update_catalog_corpus(processes=options['processes'])
+            X = corpus.matrix(vectorizer.get_feature_names_out())
+        self.stdout.write(f"Training on {X.shape[0]} documents, {X.shape[1]} words, {X.nnz} nonzeros.")
+
+        warm_start = load_model(options['warm_start'] or None) if options['warm_start'] is not None else None
+        model, log_likelihood = train(
+            X, options['topics'], options['iterations'], options['tol'], warm_start,
+            options['processes'], options['seed'], log=self.stdout.write,
+        )
+        save_model(model, vectorizer.get_feature_names_out(), options['output'], options['quantize'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['output']} (log-likelihood {log_likelihood:.4f}). Run "
+            "`manage.py backfill_topic_vectors --all` and `manage.py build_recommender` to serve it."
+        ))
@@ -0,0 +1,23 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from music.corpus import update_catalog_corpus
+
+
+class Command(BaseCommand):
+    help = "Append new catalog lyrics to the stored corpus; the vocabulary is only re-indexed if a cutoff changes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Start the corpus over from the whole catalog")
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes used to preprocess new lyrics")
+
+    def handle(self, *args, **options):
+        corpus, added, changed, rebuilt = update_catalog_corpus(options['rebuild'], options['processes'])
+        if rebuilt:
+            self.stdout.write("Corpus rebuilt from the catalog.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Added {added} songs: {corpus.n_docs} documents, {len(corpus.vocabulary)} vocabulary terms"
+            f"{' (vocabulary changed)' if changed else ''}."
+        ))
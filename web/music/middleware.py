@@ -0,0 +1,157 @@
+import hashlib
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from functools import cached_property
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .models import Playlist
+
+
+class UserState:
+    """
+    The current user's playlists and likes for one request. Each part is queried
+    at most once, on first use, so views, the context processor and templates
+    can all read it freely.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def playlists(self):
+        if not self.user.is_authenticated:
+            return []
+        return list(Playlist.objects.filter(user=self.user))
+
+    @cached_property
+    def favorites(self):
+        # Found among the playlists, no query of its own
+        return next((playlist for playlist in self.playlists if playlist.name == "Favorites"), None)
+
+    @property
+    def favorites_id(self):
+        return self.favorites.id if self.favorites is not None else None
+
+    @cached_property
+    def liked_song_ids(self):
+        if self.favorites is None:
+            return set()
+        return set(Playlist.songs.through.objects.filter(playlist_id=self.favorites.id)
+                   .values_list('song_id', flat=True))
+
+    def is_liked(self, song_id):
+        return song_id in self.liked_song_ids
+
+    def favorites_playlist(self):
+        """The user's Favorites playlist, created on first like."""
+        if self.favorites is None:
+            self.favorites, created = Playlist.objects.get_or_create(name="Favorites", user=self.user)
+            if created:
+                self.playlists.append(self.favorites)
+        return self.favorites
+
+
+class UserStateMiddleware:
+    """Attach a lazy UserState to every request as request.user_state (needs AuthenticationMiddleware)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user_state = UserState(request.user)
+        return self.get_response(request)
+
+
+# Query instrumentation
+# Per-view totals since the process started, shown on the staff page (views.query_stats)
+query_stats = {}
+query_stats_lock = threading.Lock()
+
+# Duplicate fingerprints listed in the response header
+DUPLICATES_IN_HEADER = 5
+
+
+def query_fingerprint(sql):
+    """Short hash of the query with its IN lists collapsed; parameters are never part of it."""
+    normalized = re.sub(r'\((?:%s, )+%s\)', '(%s...)', ' '.join(sql.split()))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12], normalized
+
+
+class QueryRecorder:
+    """Execute wrapper recording the SQL, parameters and duration of every query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - start))
+
+    @property
+    def total_time(self):
+        return sum(duration for sql, params, duration in self.queries)
+
+    def duplicates(self):
+        """Fingerprint -> (times run, SQL) for every query shape run more than once, most repeated first."""
+        counts = Counter()
+        sql_by_fingerprint = {}
+        for sql, params, duration in self.queries:
+            fingerprint, normalized = query_fingerprint(sql)
+            counts[fingerprint] += 1
+            sql_by_fingerprint[fingerprint] = normalized
+        return {fingerprint: (count, sql_by_fingerprint[fingerprint])
+                for fingerprint, count in counts.most_common() if count > 1}
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Debug only (settings.QUERY_INSTRUMENTATION, DEBUG by default): count the
+    queries each request runs, their total time and the query shapes run more
+    than once (the usual sign of an N+1), as X-Query-* response headers and
+    per-view totals for the staff page at /debug/queries/.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        duplicates = recorder.duplicates()
+        response['X-Query-Count'] = str(len(recorder.queries))
+        response['X-Query-Time-Ms'] = f'{recorder.total_time * 1000:.1f}'
+        response['X-Query-Duplicates'] = ', '.join(
+            f'{fingerprint}x{count}' for fingerprint, (count, sql) in list(duplicates.items())[:DUPLICATES_IN_HEADER])
+
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else request.path
+        self.record(view_name, recorder, duplicates)
+        return response
+
+    def record(self, view_name, recorder, duplicates):
+        with query_stats_lock:
+            stats = query_stats.setdefault(view_name, {
+                'view': view_name, 'requests': 0, 'queries': 0, 'max_queries': 0, 'time_ms': 0.0, 'duplicates': {},
+            })
+            stats['requests'] += 1
+            stats['queries'] += len(recorder.queries)
+            stats['max_queries'] = max(stats['max_queries'], len(recorder.queries))
+            stats['time_ms'] += recorder.total_time * 1000
+            for fingerprint, (count, sql) in duplicates.items():
+                seen = stats['duplicates'].setdefault(fingerprint, {'sql': sql, 'max_count': 0})
+                seen['max_count'] = max(seen['max_count'], count)
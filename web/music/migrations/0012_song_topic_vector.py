@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-17 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0011_remove_song_mp3_path_song_mp3_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='lyrics_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='top_topic',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, help_text='Most likely topic, numbered from 1', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='topic_vector',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.6 on 2026-10-17 20:12
+
+import zlib
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 2000
+
+
+def move_lyrics_out(apps, schema_editor):
+    Song = apps.get_model('music', 'Song')
+    SongLyrics = apps.get_model('music', 'SongLyrics')
+    compress = getattr(settings, 'LYRICS_COMPRESSION', True)
+    songs = Song.objects.exclude(lyrics=None).exclude(lyrics='').order_by('id').values_list('id', 'lyrics')
+    batch = []
+    for song_id, lyrics in songs.iterator(chunk_size=BATCH_SIZE):
+        data = lyrics.encode('utf-8')
+        packed = zlib.compress(data, 6) if compress else data
+        if len(packed) < len(data):
+            batch.append(SongLyrics(song_id=song_id, data=packed, compressed=True))
+        else:
+            batch.append(SongLyrics(song_id=song_id, data=data, compressed=False))
+        if len(batch) == BATCH_SIZE:
+            SongLyrics.objects.bulk_create(batch)
+            batch = []
+    SongLyrics.objects.bulk_create(batch)
+
+
+def move_lyrics_back(apps, schema_editor):
+    Song = apps.get_model('music', 'Song')
+    SongLyrics = apps.get_model('music', 'SongLyrics')
+    batch = []
+    for song_lyrics in SongLyrics.objects.order_by('song_id').iterator(chunk_size=BATCH_SIZE):
+        data = bytes(song_lyrics.data)
+        lyrics = (zlib.decompress(data) if song_lyrics.compressed else data).decode('utf-8')
+        batch.append(Song(id=song_lyrics.song_id, lyrics=lyrics))
+        if len(batch) == BATCH_SIZE:
+            Song.objects.bulk_update(batch, ['lyrics'])
+            batch = []
+    Song.objects.bulk_update(batch, ['lyrics'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0014_tasteprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongLyrics',
+            fields=[
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lyrics_storage', serialize=False, to='music.song')),
+                ('data', models.BinaryField()),
+                ('compressed', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(move_lyrics_out, move_lyrics_back),
+        migrations.RemoveField(
+            model_name='song',
+            name='lyrics',
+        ),
+    ]
@@ -0,0 +1,61 @@
+import zlib
+
+from django.conf import settings
+from django.db import migrations
+
+BATCH_SIZE = 2000
+
+# Word prefixes of 3 characters get their own index entries, so short prefix
+# queries do not scan every term (shorter query words only match whole words,
+# see music.search.PREFIX_MIN_LENGTH)
+CREATE_SEARCH_TABLE = """
+    CREATE VIRTUAL TABLE music_songsearch USING fts5(
+        title, artist, album, lyrics,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '3'
+    )
+"""
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; elsewhere music.search falls back to substring matches
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SEARCH_TABLE)
+
+    Song = apps.get_model('music', 'Song')
+    SongLyrics = apps.get_model('music', 'SongLyrics')
+    index_lyrics = getattr(settings, 'SEARCH_INDEX_LYRICS', True)
+    songs = Song.objects.order_by('id').values_list('id', 'song_title', 'artist__name', 'album__album_title')
+    last_id = 0
+    while True:
+        batch = list(songs.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        lyrics = {}
+        if index_lyrics:
+            for song_lyrics in SongLyrics.objects.filter(song_id__in=[row[0] for row in batch]):
+                data = bytes(song_lyrics.data)
+                lyrics[song_lyrics.song_id] = (zlib.decompress(data) if song_lyrics.compressed else data).decode('utf-8')
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO music_songsearch (rowid, title, artist, album, lyrics) VALUES (%s, %s, %s, %s, %s)",
+                [(song_id, title, artist or '', album or '', lyrics.get(song_id, ''))
+                 for song_id, title, artist, album in batch])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE music_songsearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0015_songlyrics'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
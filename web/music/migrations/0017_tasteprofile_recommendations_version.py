@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-17 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0016_songsearch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tasteprofile',
+            name='recommendations_version',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -1,147 +1,774 @@
 # Models
-import re
 import os
+import shutil
+import hashlib
+from datetime import datetime
+import heapq
+import threading
+from itertools import islice
 import numpy as np
 import pickle
-import nltk
 import json
 from sklearn.feature_extraction import text
 from django.conf import settings
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
 from sklearn.feature_extraction.text import CountVectorizer
+from .ann import IVFIndex, top_k, transform
+from .plsa import fold_in
+from .preprocessing import preprocess_lyrics, preprocess_many
 
 
-stemmer = PorterStemmer()
-nltk.download('punkt_tab')
-nltk.download('stopwords')
+# Extra stopwords used when fitting the corpus vectorizer
+EXTRA_STOPWORDS = ['hmmmmm', 'ah', 'someth', 'caus', 'kany', 'ill', 'wan',
+                   'ive', 'want', 'id', 'ayo', 'arent', 'laci', 'steve', 'na',
+                   'daniel', 'caesar', 'mayb', 'em', 'oh', 'song', 'lyrics',
+                   'chorus', 'kendrick', 'lamar', 'choru', 'ye', 'ooh',
+                   'dont', 'kanye', 'vincent', 'aah', 'vers', 'like', 'intro',
+                   'hello', 'aaliyah', 'skit', 'hmmmmm ', 'aint', 'im', 'yeah',
+                   'yo', 'brent', 'faiyaz', 'mm']
 
 
-# Load model function
-def load_model(filename='plsa_model.pkl'):
-    model_path = os.path.join(settings.BASE_DIR, 'music', 'models', filename)
-    with open(model_path, 'rb') as f:
-        P_d_z, P_w_z, P_z = pickle.load(f)
-    return P_d_z, P_w_z, P_z
+# Document-frequency cutoffs of the corpus vocabulary
+CORPUS_MIN_DF = 2
+CORPUS_MAX_DF = 0.95
+
+
+# Precomputed recommender artifacts, written by `manage.py build_recommender`.
+# Bump the version whenever their layout changes so stale files are ignored.
+ARTIFACT_VERSION = 5
+
+# Releases written by build_recommender, one directory each, and the file naming the live one
+RELEASES_DIR = 'releases'
+CURRENT_POINTER = 'current'
+
+# pLSA model in the artifact format (see save_model), preferred over plsa_model.pkl
+MODEL_DIR = 'plsa'
+MODEL_FORMAT_VERSION = 1
+
+# Ways of estimating P(z|d) for new lyrics, see RecommenderEngine.topic_distributions
+INFERENCE_MODES = ('projection', 'fold_in')
 
+# Genre-filtered ANN searches fetch this many times top_n candidates before filtering
+ANN_GENRE_OVERSAMPLE = 4
 
-def preprocess_lyrics(lyrics):
-    # Check if the lyrics are valid (not null and are strings)
-    if isinstance(lyrics, str):
-        # Remove special characters, numbers, etc.
-        lyrics = re.sub(r'[^a-zA-Z\s]', '', lyrics)
-        # Convert to lowercase
-        lyrics = lyrics.lower()
 
-        # Tokenize the text
-        tokens = word_tokenize(lyrics)
+def model_path(filename):
+    return os.path.join(settings.BASE_DIR, 'music', 'models', filename)
 
-        # Remove stopwords
-        stop_words = set(stopwords.words('english'))
-        tokens = [word for word in tokens if word not in stop_words]
 
-        # Apply stemming
-        tokens = [stemmer.stem(word) for word in tokens]
+def artifact_path(name):
+    return model_path(f'recommender_v{ARTIFACT_VERSION}_{name}')
 
-        # Join back the processed tokens into a string
-        lyrics = ' '.join(tokens)
+
+def vocabulary_hash(vocabulary):
+    return hashlib.sha1('\n'.join(str(word) for word in vocabulary).encode('utf-8')).hexdigest()
+
+
+def _replace_dir(path, write):
+    # Fill a sibling directory, then swap it in place of the old one
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    write(tmp_path)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def save_model(model, vocabulary, dirname=MODEL_DIR, quantize=False, dtype=np.float32):
+    """
+    Write (P_d_z, P_w_z, P_z) as .npy files plus a manifest.json of shapes, dtypes,
+    topic count and the hash of the vocabulary P_w_z rows follow. With quantize,
+    P_w_z is stored as uint8 with one scale per topic (max error scale / 2).
+    That only shrinks the files: load_model dequantizes P_w_z into a private
+    float32 array in every process, so it takes as much memory as an unquantized model.
+    """
+    P_d_z, P_w_z, P_z = (np.asarray(P, dtype=dtype) for P in model)
+    arrays = {'P_d_z': P_d_z, 'P_z': P_z}
+    if quantize:
+        scale = np.maximum(P_w_z.max(axis=0), np.finfo(np.float32).tiny) / 255
+        arrays['P_w_z_quantized'] = np.rint(P_w_z / scale).astype(np.uint8)
+        arrays['P_w_z_scale'] = scale.astype(np.float32)
     else:
-        # If not a valid string, return an empty string
-        lyrics = ''
+        arrays['P_w_z'] = P_w_z
+    manifest = {
+        'format_version': MODEL_FORMAT_VERSION,
+        'topics': P_w_z.shape[1],
+        'quantized': bool(quantize),
+        'vocabulary_hash': vocabulary_hash(vocabulary),
+        'arrays': {name: {'shape': list(array.shape), 'dtype': str(array.dtype)} for name, array in arrays.items()},
+    }
 
-    return lyrics
+    def write(path):
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), array)
+        with open(os.path.join(path, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
 
+    _replace_dir(model_path(dirname), write)
+    return manifest
 
-def predict_song_topic(new_lyrics, top_n=20):
+
+def check_vocabulary(manifest, vocabulary):
+    """Raise ValueError if the model in the manifest was trained on another vocabulary."""
+    if manifest is not None and manifest['vocabulary_hash'] != vocabulary_hash(vocabulary):
+        raise ValueError("The pLSA model was trained on a different vocabulary than the corpus, "
+                         "retrain it with `manage.py train_plsa`.")
+
+
+def load_manifest(dirname=MODEL_DIR):
+    """The model manifest, or None if there is no model in the artifact format."""
+    try:
+        with open(model_path(os.path.join(dirname, 'manifest.json')), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if manifest.get('format_version') != MODEL_FORMAT_VERSION:
+        raise ValueError(f"Unsupported model format {manifest.get('format_version')} in {dirname}")
+    return manifest
+
+
+# Load model function
+def load_model(filename=None):
     """
-    Predict the top topics for a new song based on its lyrics, and find the most related songs in the corpus.
+    (P_d_z, P_w_z, P_z). By default the artifact-format model in MODEL_DIR, memory-mapped
+    read-only (except a quantized P_w_z, which is dequantized in memory), falling back
+    to the legacy plsa_model.pkl; a filename ending in .pkl is unpickled, anything else
+    is read as a model directory.
+    """
+    if filename is None:
+        filename = MODEL_DIR if load_manifest() is not None else 'plsa_model.pkl'
+    if filename.endswith('.pkl'):
+        with open(model_path(filename), 'rb') as f:
+            P_d_z, P_w_z, P_z = pickle.load(f)
+        return P_d_z, P_w_z, P_z
 
-    Args:
-    - new_lyrics (str): Lyrics of the new song to predict the topic for.
-    - all_cleaned_lyrics (list of str): List of all preprocessed lyrics in the corpus.
-    - song_indices_path (str): Path to the song indices JSON file.
-    - P_w_z (ndarray): The trained P(w|z) matrix from the pLSA model.
-    - vectorizer (CountVectorizer, optional): Pre-trained vectorizer. If None, a new one will be fitted.
-    - top_n (int, optional): The number of top related songs to return. Defaults to 5.
-    - max_df (float, optional): Max document frequency for fitting the vectorizer (used if vectorizer is None).
-    - min_df (int, optional): Min document frequency for fitting the vectorizer (used if vectorizer is None).
+    manifest = load_manifest(filename)
+    if manifest is None:
+        raise FileNotFoundError(f"No model manifest in {model_path(filename)}")
 
-    Returns:
-    - Tuple containing the top topic for the new song, its probability, and the list of related songs.
+    def array(name):
+        return np.load(model_path(os.path.join(filename, f'{name}.npy')), mmap_mode='r')
+
+    P_w_z = array('P_w_z_quantized') * array('P_w_z_scale') if manifest['quantized'] else array('P_w_z')
+    return array('P_d_z'), P_w_z, array('P_z')
+
+
+def load_json(filename):
+    with open(model_path(filename), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def normalize_rows(P, epsilon=1e-10):
+    # Add a small epsilon value to prevent division by zero
+    row_sums = P.sum(axis=1, keepdims=True)
+    row_sums[row_sums == 0] = epsilon
+    P /= row_sums
+    return P
+
+
+def project_topics(X, P_w_z):
+    """
+    P(z|d) for every row of the sparse document-term matrix X, normalized per row.
+
+    X stays sparse: the sparse x dense product only ever allocates the
+    documents x topics result, never a dense documents x vocabulary matrix.
+    """
+    return normalize_rows(np.asarray(X @ P_w_z, dtype=np.float64))
+
+
+def corpus_stop_words():
+    return sorted(text.ENGLISH_STOP_WORDS.union(EXTRA_STOPWORDS))
+
+
+def fit_vectorizer():
     """
+    Fit the vectorizer on the cleaned lyrics corpus. Its vocabulary is the row order
+    of P_w_z. Returns the vectorizer and the corpus document-term matrix.
+    """
+    all_cleaned_lyrics = load_json('all_cleaned_lyrics.json')
+    vectorizer = CountVectorizer(max_df=CORPUS_MAX_DF, min_df=CORPUS_MIN_DF, stop_words=corpus_stop_words())
+    return vectorizer, vectorizer.fit_transform(all_cleaned_lyrics)
+
+
+def fit_corpus(P_w_z):
+    """
+    Fit the vectorizer on the cleaned lyrics corpus and project every song onto the topics.
+
+    Returns the vocabulary (in P_w_z row order), the normalized corpus topic matrix
+    and the song index as (titles, genres, song ids), see resolve_song_ids.
+    """
+    vectorizer, X_corpus = fit_vectorizer()
+
+    # Topic distribution for all songs in the corpus, P(z|d) = X * P(w|z)
+    P_z_corpus = project_topics(X_corpus, P_w_z)
+
+    song_indices = load_json('song_indices_with_genre.json')
+    titles = np.array([song_name for song_name, song_genre in song_indices])
+    genres = np.array([song_genre for song_name, song_genre in song_indices])
+    song_ids = resolve_song_ids(titles, genres)
+    return vectorizer.get_feature_names_out().astype(str), P_z_corpus, (titles, genres, song_ids)
+
+
+def resolve_song_ids(titles, genres):
+    """
+    Song id of every JSON corpus row, or -1 if it is not in the catalog.
+
+    The JSON corpus only knows title and genre, and titles repeat (e.g. "Intro"),
+    so the k-th row with a given (title, genre) maps to the k-th such Song by id.
+    """
+    from .models import Song
+
+    candidates = {}
+    for song_id, song_title, genre in Song.objects.order_by('id').values_list('id', 'song_title', 'genre'):
+        candidates.setdefault((song_title, genre), []).append(song_id)
+
+    song_ids = np.full(len(titles), -1, dtype=np.int64)
+    for row, key in enumerate(zip(titles.tolist(), genres.tolist())):
+        if candidates.get(key):
+            song_ids[row] = candidates[key].pop(0)
+    return song_ids
+
+
+def catalog_corpus(chunk_size=2000):
+    """
+    The corpus topic matrix and song index read straight from the topic vectors
+    stored on Song, or None if no song has one yet (see backfill_topic_vectors).
+    """
+    from .models import Song
+
+    songs = (Song.objects.exclude(topic_vector=None).order_by('id')
+             .values_list('id', 'song_title', 'genre', 'topic_vector'))
+    song_ids, titles, genres, vectors = [], [], [], []
+    for song_id, song_title, genre, topic_vector in songs.iterator(chunk_size=chunk_size):
+        song_ids.append(song_id)
+        titles.append(song_title)
+        genres.append(genre or '')
+        vectors.append(np.frombuffer(topic_vector, dtype=np.float32))
+    if not vectors:
+        return None
+    P_z_corpus = np.vstack(vectors).astype(np.float64)
+    return P_z_corpus, (np.array(titles), np.array(genres), np.array(song_ids, dtype=np.int64))
+
+
+def build_topic_index(P_z_corpus):
+    """
+    For every topic, the corpus rows sorted by descending P(z|d) (int32) and their probabilities.
+    Both arrays are topics x songs, so the top N songs for topic k are a slice of row k.
+    """
+    topic_rank = np.argsort(-P_z_corpus, axis=0, kind='stable').T.astype(np.int32)
+    topic_rank_scores = np.take_along_axis(P_z_corpus.T, topic_rank, axis=1)
+    return topic_rank, topic_rank_scores
+
+
+def build_genre_index(P_z_corpus, genres):
+    """
+    The per-topic ranking partitioned by genre: for every topic, the rows of each
+    genre sorted by descending P(z|d), one genre after the other. Genre g of topic
+    k is genre_rank[k, genre_offsets[g]:genre_offsets[g + 1]].
+    """
+    genre_names, genre_codes = np.unique(genres, return_inverse=True)
+    genre_offsets = np.concatenate([[0], np.cumsum(np.bincount(genre_codes, minlength=len(genre_names)))])
+    genre_rank = np.empty(P_z_corpus.T.shape, dtype=np.int32)
+    for topic_index in range(P_z_corpus.shape[1]):
+        genre_rank[topic_index] = np.lexsort((-P_z_corpus[:, topic_index], genre_codes))
+    genre_rank_scores = np.take_along_axis(P_z_corpus.T, genre_rank, axis=1)
+    return genre_names, genre_offsets, genre_rank, genre_rank_scores
+
+
+def _atomic_save(path, save, *args, **kwargs):
+    # Write next to the target and swap it in, so running workers never map a half-written file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        save(f, *args, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def release_path(release, name=None):
+    path = os.path.join(model_path(RELEASES_DIR), release)
+    return os.path.join(path, name) if name else path
+
+
+def current_release():
+    """Name of the release the pointer file names, or None if nothing was released yet."""
     try:
-        # Load the pLSA model
-        P_d_z, P_w_z, P_z = load_model()
-        print("Model loaded successfully.")
-    except Exception as e:
-        print(f"Error loading model: {e}")
-        return None, None, []
+        with open(model_path(os.path.join(RELEASES_DIR, CURRENT_POINTER)), 'r', encoding='utf-8') as f:
+            release = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return release if release and os.path.isdir(release_path(release)) else None
 
-    # Step 1: Preprocess the new lyrics
-    preprocessed_lyrics = preprocess_lyrics(new_lyrics)
 
-    cleaned_lyrics_path = os.path.join(settings.BASE_DIR, 'music', 'models', 'all_cleaned_lyrics.json')
+def release_pointer_mtime():
+    """Cheap change check for the current pointer: its mtime, or None if it does not exist."""
     try:
-        with open(cleaned_lyrics_path, 'r', encoding='utf-8') as f:
-            all_cleaned_lyrics = json.load(f)
-        print(f"Successfully loaded {len(all_cleaned_lyrics)} items from all_cleaned_lyrics.json")
+        return os.stat(model_path(os.path.join(RELEASES_DIR, CURRENT_POINTER))).st_mtime_ns
     except FileNotFoundError:
-        print(f"File not found: {cleaned_lyrics_path}")
-    except json.JSONDecodeError:
-        print(f"Error decoding JSON from file: {cleaned_lyrics_path}")
+        return None
 
-    # Step 2: Fit or use the existing vectorizer
-    extra_stopwords = ['hmmmmm','ah','someth','caus','kany','ill','wan',
-                       'ive','want','id','ayo','arent','laci','steve','na',
-                       'daniel','caesar','mayb','em','oh','song', 'lyrics',
-                       'chorus', 'kendrick', 'lamar', 'choru', 'ye', 'ooh',
-                       'dont', 'kanye','vincent','aah', 'vers','like','intro',
-                       'hello', 'aaliyah','skit', 'hmmmmm ', 'aint', 'im','yeah',
-                       'yo','brent','faiyaz','mm']
 
+def publish_release(release):
+    """Point current at the release. The pointer file is replaced atomically, readers see either release."""
+    pointer = model_path(os.path.join(RELEASES_DIR, CURRENT_POINTER))
+    _atomic_save(pointer, lambda f: f.write(release.encode('utf-8')))
 
-    custom_stop_words = list(text.ENGLISH_STOP_WORDS.union(extra_stopwords))
 
-    vectorizer = CountVectorizer(max_df=0.95, min_df=2, stop_words=custom_stop_words)
-    X_corpus = vectorizer.fit_transform(all_cleaned_lyrics)  # Fit the vectorizer on the existing corpus
+def prune_releases(keep):
+    """Delete all but the newest `keep` releases (never the current one). Workers still mapping them are unaffected."""
+    current = current_release()
+    # Oldest first by build id: release names start with the artifact version, which sorts v10 before v5
+    releases = sorted((entry for entry in os.listdir(model_path(RELEASES_DIR))
+                       if os.path.isdir(release_path(entry)) and not entry.endswith('.tmp')),
+                      key=lambda release: release.rsplit('-', 1)[-1])
+    for release in releases[:-keep] if keep > 0 else releases:
+        if release != current:
+            shutil.rmtree(release_path(release), ignore_errors=True)
 
-    # Step 3: Vectorize the new lyrics using the fitted vectorizer
-    new_X = vectorizer.transform([preprocessed_lyrics]).toarray()
 
-    # Step 4: Calculate the topic distribution for the new lyrics
-    P_z_new = np.dot(new_X, P_w_z)  # P(z|d) = X * P(w|z)
-    P_z_new /= P_z_new.sum()  # Normalize
+def build_artifacts(ann=None, publish=True):
+    """
+    Run the full corpus pipeline once and write a new release: a directory holding a
+    copy of the served pLSA model and everything derived from it. The release is made
+    current (picked up by running workers between requests) unless publish is False.
 
-    # Step 5: Get the top topic for the new song
-    top_index = np.argmax(P_z_new[0])  # Get the index of the highest probability
-    top_topic_probability = P_z_new[0][top_index]
-    print(f"\nTop Topic for the New Song: Topic {top_index + 1} with Probability {top_topic_probability:.4f}")
+    The ANN index is built when ann is True, or by default once the corpus reaches
+    settings.RECOMMENDER_ANN_MIN_ROWS songs.
+    """
+    model = load_model()
+    vocabulary, P_z_corpus, (titles, genres, song_ids) = fit_corpus(model[1])
+    source = 'json'
+    # Prefer the vectors stored on the catalog once they have been backfilled
+    catalog = catalog_corpus()
+    if catalog is not None:
+        P_z_corpus, (titles, genres, song_ids) = catalog
+        source = 'catalog'
+        if P_z_corpus.shape[1] != model[1].shape[1]:
+            raise ValueError(f"The catalog topic vectors have {P_z_corpus.shape[1]} topics but the model has "
+                             f"{model[1].shape[1]}, run `manage.py backfill_topic_vectors --all` first.")
+    # Microseconds keep release names unique and in build order
+    build_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    release = f'v{ARTIFACT_VERSION}-{build_id}'
+    if ann is None:
+        ann = len(P_z_corpus) >= settings.RECOMMENDER_ANN_MIN_ROWS
 
-    # Step 6: Calculate the topic distribution for all songs in the corpus
-    P_z_corpus = np.dot(X_corpus.toarray(), P_w_z)  # P(z|d) = X * P(w|z)
+    def write(directory):
+        manifest = load_manifest()
+        if manifest is not None:
+            shutil.copytree(model_path(MODEL_DIR), os.path.join(directory, 'model'))
+        else:
+            save_model(model, vocabulary, os.path.join(directory, 'model'))
+        np.save(os.path.join(directory, 'vocabulary.npy'), vocabulary)
+        np.save(os.path.join(directory, 'corpus_topics.npy'), P_z_corpus)
+        np.save(os.path.join(directory, 'corpus_hellinger.npy'), transform(P_z_corpus))
+        topic_rank, topic_rank_scores = build_topic_index(P_z_corpus)
+        np.save(os.path.join(directory, 'topic_rank.npy'), topic_rank)
+        np.save(os.path.join(directory, 'topic_rank_scores.npy'), topic_rank_scores)
+        genre_names, genre_offsets, genre_rank, genre_rank_scores = build_genre_index(P_z_corpus, genres)
+        np.save(os.path.join(directory, 'genre_rank.npy'), genre_rank)
+        np.save(os.path.join(directory, 'genre_rank_scores.npy'), genre_rank_scores)
+        np.savez(os.path.join(directory, 'songs.npz'),
+                 titles=titles, genres=genres, song_ids=song_ids, source=source, build_id=build_id,
+                 genre_names=genre_names, genre_offsets=genre_offsets)
+        if ann:
+            IVFIndex().build(P_z_corpus).save(os.path.join(directory, 'ann'), build_id=build_id)
 
-    # Step 6.1: Add a small epsilon value to prevent division by zero
-    row_sums = P_z_corpus.sum(axis=1, keepdims=True)
-    epsilon = 1e-10
-    row_sums[row_sums == 0] = epsilon
-    P_z_corpus /= row_sums  # Normalize for each song
-
-    # Step 7: Find the songs with the highest probability for the top topic
-    related_song_indices = np.argsort(P_z_corpus[:, top_index])[::-1]  # Sort by highest probability for the top topic
-
-    song_indices_path = os.path.join(settings.BASE_DIR, 'music', 'models', 'song_indices_with_genre.json')
-    with open(song_indices_path, 'r', encoding='utf-8') as f:
-        song_indices = json.load(f)
-
-    # Step 9: Output the related songs with genres
-    print("Top Related Songs for the New Song's Top Topic:")
-    related_songs = []
-    for idx in related_song_indices[:top_n]:
-        song_data = song_indices[idx]  # Retrieve song data from the loaded JSON
-        song_name, song_genre = song_data  # Extract the name and genre
-        song_probability = P_z_corpus[idx, top_index]
-        print(f"Song: {song_name} | Genre: {song_genre} | Probability {song_probability:.4f}")
-        related_songs.append((song_name, song_genre, song_probability))
-
-    return top_index + 1, top_topic_probability, related_songs
\ No newline at end of file
+    # The release directory only appears once complete
+    _replace_dir(release_path(release), write)
+    if publish:
+        publish_release(release)
+        prune_releases(settings.RECOMMENDER_KEEP_RELEASES)
+    return release, P_z_corpus.shape
+
+
+def load_artifacts(directory):
+    """
+    Memory-map the corpus artifacts of a release, read-only so that every worker
+    process shares the same pages. Returns None if they are missing.
+    """
+    try:
+        vocabulary = np.load(os.path.join(directory, 'vocabulary.npy'), mmap_mode='r')
+        P_z_corpus = np.load(os.path.join(directory, 'corpus_topics.npy'), mmap_mode='r')
+        with np.load(os.path.join(directory, 'songs.npz')) as songs:
+            song_index = songs['titles'], songs['genres'], songs['song_ids']
+            source, build_id = str(songs['source']), str(songs['build_id'])
+    except FileNotFoundError:
+        return None
+    return vocabulary, P_z_corpus, song_index, source, build_id
+
+
+def load_topic_index(directory, P_z_corpus):
+    """
+    Memory-map the per-topic ranked index. Returns None if it is missing or does
+    not match the corpus topic matrix, in which case callers rank per request.
+    """
+    try:
+        topic_rank = np.load(os.path.join(directory, 'topic_rank.npy'), mmap_mode='r')
+        topic_rank_scores = np.load(os.path.join(directory, 'topic_rank_scores.npy'), mmap_mode='r')
+    except FileNotFoundError:
+        return None
+    if topic_rank.shape != P_z_corpus.T.shape or topic_rank_scores.shape != topic_rank.shape:
+        return None
+    return topic_rank, topic_rank_scores
+
+
+def load_genre_index(directory, P_z_corpus):
+    """Memory-map the genre-partitioned ranking, or None if it is missing or stale."""
+    try:
+        genre_rank = np.load(os.path.join(directory, 'genre_rank.npy'), mmap_mode='r')
+        genre_rank_scores = np.load(os.path.join(directory, 'genre_rank_scores.npy'), mmap_mode='r')
+        with np.load(os.path.join(directory, 'songs.npz')) as songs:
+            genre_names, genre_offsets = songs['genre_names'], songs['genre_offsets']
+    except FileNotFoundError:
+        return None
+    if genre_rank.shape != P_z_corpus.T.shape or genre_offsets[-1] != P_z_corpus.shape[0]:
+        return None
+    return genre_names, genre_offsets, genre_rank, genre_rank_scores
+
+
+def load_search_matrix(directory, P_z_corpus, metric='hellinger'):
+    """
+    The corpus rows transformed for similarity search (see ann.transform): memory-mapped
+    from the release when it has them for this metric, else transformed once here.
+    """
+    if directory is not None and metric == 'hellinger':
+        try:
+            X = np.load(os.path.join(directory, 'corpus_hellinger.npy'), mmap_mode='r')
+        except FileNotFoundError:
+            X = None
+        if X is not None and X.shape == P_z_corpus.shape:
+            return X
+    return transform(P_z_corpus, metric)
+
+
+def load_ann_index(directory, build_id):
+    """Memory-map the ANN index, or None if it is missing or was built for another build."""
+    try:
+        index = IVFIndex.load(os.path.join(directory, 'ann'))
+    except FileNotFoundError:
+        return None
+    if build_id is None or index.meta.get('build_id') != build_id:
+        return None
+    return index
+
+
+class RecommenderEngine:
+    """
+    Everything predict_song_topic needs that does not depend on the query:
+    the pLSA matrices, the corpus vocabulary, the normalized topic distribution
+    of every corpus song and the song index.
+
+    Everything is memory-mapped from a release written by build_recommender
+    (by default the current one); without a release the corpus is fitted
+    in-process instead. Build the engine once (see get_engine) and reuse it
+    across requests.
+    """
+
+    def __init__(self, release=None):
+        self.release = release
+        directory = release_path(release) if release is not None else None
+        artifacts = load_artifacts(directory) if directory is not None else None
+        if artifacts is None:
+            print("Recommender release not found, fitting the corpus in-process. "
+                  "Run `manage.py build_recommender` to skip this step.")
+            self.P_d_z, self.P_w_z, self.P_z = load_model()
+            manifest = load_manifest()
+            vocabulary, self.P_z_corpus, song_index = fit_corpus(self.P_w_z)
+            self.source, self.build_id = 'json', None
+            self.topic_index = self.genre_index = self.ann_index = None
+        else:
+            # Load the pLSA model shipped with the release
+            self.P_d_z, self.P_w_z, self.P_z = load_model(os.path.join(directory, 'model'))
+            manifest = load_manifest(os.path.join(directory, 'model'))
+            vocabulary, self.P_z_corpus, song_index, self.source, self.build_id = artifacts
+            self.topic_index = load_topic_index(directory, self.P_z_corpus)
+            self.genre_index = load_genre_index(directory, self.P_z_corpus)
+            self.ann_index = load_ann_index(directory, self.build_id)
+        self.song_titles, self.song_genres, self.song_ids = song_index
+        self.song_ids_stale = False
+        self.genre_names, self.genre_codes = np.unique(self.song_genres, return_inverse=True)
+        # Exact searches rank by the ANN index's metric, so both paths agree
+        self.metric = self.ann_index.metric if self.ann_index is not None else 'hellinger'
+        self.X_corpus = load_search_matrix(directory, self.P_z_corpus, self.metric)
+
+        check_vocabulary(manifest, vocabulary)
+        if self.P_z_corpus.shape[1] != self.P_w_z.shape[1]:
+            raise ValueError(f"The corpus topic matrix has {self.P_z_corpus.shape[1]} topics but the model has "
+                             f"{self.P_w_z.shape[1]}, rebuild the release with `manage.py build_recommender`.")
+        self.vectorizer = CountVectorizer(vocabulary=[str(word) for word in vocabulary])
+        self.inference = settings.RECOMMENDER_INFERENCE
+        if self.inference not in INFERENCE_MODES:
+            raise ValueError(f"Unknown RECOMMENDER_INFERENCE {self.inference!r}, expected one of {INFERENCE_MODES}")
+        # Anything derived from the engine's output is only valid for this version
+        self.version = f"v{ARTIFACT_VERSION}-{self.build_id or 'fitted'}"
+        if self.inference != 'projection':
+            self.version += f"-{self.inference}"
+        print(f"Recommender engine ready: {len(self.song_titles)} songs, {self.P_w_z.shape[1]} topics.")
+
+    def topic_distributions(self, preprocessed_lyrics_list, inference=None):
+        """
+        P(z|d) of preprocessed lyrics, one row each, by projection or fold-in
+        (default settings.RECOMMENDER_INFERENCE).
+        """
+        # One sparse matrix for the whole batch
+        new_X = self.vectorizer.transform(preprocessed_lyrics_list)
+        P_z_new = project_topics(new_X, self.P_w_z)
+        if (inference or self.inference) == 'fold_in':
+            P_z_new = fold_in(new_X, self.P_w_z, settings.RECOMMENDER_FOLD_IN_ITERATIONS,
+                              settings.RECOMMENDER_FOLD_IN_TOL, P_z_d=P_z_new)
+        return P_z_new
+
+    def topic_distribution(self, preprocessed_lyrics):
+        return self.topic_distributions([preprocessed_lyrics])[0]
+
+    def topic_vectors(self, lyrics_list, processes=1):
+        """Topic distributions of raw lyrics as float32 rows, as stored on Song.topic_vector."""
+        return self.topic_distributions(preprocess_many(lyrics_list, processes)).astype(np.float32)
+
+    def top_rows(self, topic_index, top_n=20):
+        """Corpus rows with the highest probability for the topic, best first, and their probabilities."""
+        if self.topic_index is not None:
+            topic_rank, topic_rank_scores = self.topic_index
+            return topic_rank[topic_index, :top_n], topic_rank_scores[topic_index, :top_n]
+
+        # No usable index: partition out the top N, then sort only those
+        column = self.P_z_corpus[:, topic_index]
+        top_n = min(top_n, len(column))
+        if top_n <= 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=column.dtype)
+        rows = np.argpartition(-column, top_n - 1)[:top_n]
+        rows = rows[np.argsort(-column[rows], kind='stable')]
+        return rows, column[rows]
+
+    def top_rows_in_genres(self, topic_index, genres, top_n=20):
+        """Like top_rows, but only over songs of the given genres."""
+        if self.genre_index is not None:
+            genre_names, genre_offsets, genre_rank, genre_rank_scores = self.genre_index
+            # k-way merge of the genres' pre-sorted runs; none needs more than top_n entries
+            runs = []
+            for code in np.flatnonzero(np.isin(genre_names, list(genres))):
+                start, end = genre_offsets[code], min(genre_offsets[code + 1], genre_offsets[code] + top_n)
+                runs.append(zip(genre_rank_scores[topic_index, start:end].tolist(),
+                                genre_rank[topic_index, start:end].tolist()))
+            top = list(islice(heapq.merge(*runs, key=lambda run: -run[0]), top_n))
+            return (np.array([row for score, row in top], dtype=np.int32),
+                    np.array([score for score, row in top], dtype=self.P_z_corpus.dtype))
+
+        # No usable index: rank only the rows of those genres
+        genre_rows = np.flatnonzero(np.isin(self.song_genres, list(genres)))
+        column = self.P_z_corpus[genre_rows, topic_index]
+        top_n = min(top_n, len(column))
+        if top_n <= 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=column.dtype)
+        best = np.argpartition(-column, top_n - 1)[:top_n]
+        best = best[np.argsort(-column[best], kind='stable')]
+        return genre_rows[best], column[best]
+
+    def refresh_song_ids(self):
+        """Re-resolve the row -> Song id mapping after the catalog changed (see signals.py)."""
+        self.song_ids = resolve_song_ids(self.song_titles, self.song_genres)
+        self.song_ids_stale = False
+
+    def related_songs(self, topic_index, top_n=20, genres=None):
+        if self.song_ids_stale:
+            self.refresh_song_ids()
+        if genres is None:
+            rows, probabilities = self.top_rows(topic_index, top_n)
+        else:
+            rows, probabilities = self.top_rows_in_genres(topic_index, genres, top_n)
+        return [
+            (str(self.song_titles[idx]), str(self.song_genres[idx]), float(probability),
+             int(self.song_ids[idx]) if self.song_ids[idx] >= 0 else None)
+            for idx, probability in zip(rows, probabilities)
+        ]
+
+    def songs_for_rows(self, rows, scores):
+        return [
+            (str(self.song_titles[row]), str(self.song_genres[row]), float(score),
+             int(self.song_ids[row]) if self.song_ids[row] >= 0 else None)
+            for row, score in zip(rows, scores)
+        ]
+
+    def genre_rows(self, genres):
+        return np.flatnonzero(np.isin(self.genre_codes, np.flatnonzero(np.isin(self.genre_names, list(genres)))))
+
+    def ann_rows(self, vector, top_n, genres=None):
+        """
+        Rows and similarities from the ANN index, over-fetching when filtering by genre.
+        Returns None when there is no index or too few matches survive the filter.
+        """
+        if self.ann_index is None:
+            return None
+        k = top_n if genres is None else top_n * ANN_GENRE_OVERSAMPLE
+        rows, scores = self.ann_index.search(vector, k)
+        if genres is not None:
+            keep = np.isin(self.song_genres[rows], list(genres))
+            rows, scores = rows[keep], scores[keep]
+        if len(rows) < min(top_n, len(self.song_titles)):
+            return None
+        return rows[:top_n], scores[:top_n]
+
+    def exact_rows(self, vector, top_n, genres=None):
+        """
+        Rows and similarities scoring the whole corpus by the ANN index's metric
+        (Hellinger without an index), one matrix-vector product over X_corpus.
+        """
+        q = transform(vector, self.metric)[0]
+        if genres is None:
+            scores = self.X_corpus @ q
+            best = top_k(scores, top_n)
+            return best, scores[best]
+        rows = self.genre_rows(genres)
+        scores = self.X_corpus[rows] @ q
+        best = top_k(scores, top_n)
+        return rows[best], scores[best]
+
+    def similar_songs(self, vector, top_n=20, genres=None):
+        """
+        Songs whose topic distributions are closest to the vector by Hellinger similarity,
+        best first, as (song name, genre, similarity, Song id or None).
+        """
+        if self.song_ids_stale:
+            self.refresh_song_ids()
+        approximate = self.ann_rows(vector, top_n, genres)
+        if approximate is not None:
+            return self.songs_for_rows(*approximate)
+        return self.songs_for_rows(*self.exact_rows(vector, top_n, genres))
+
+    def score_profile(self, profile, top_n=20, genres=None):
+        """
+        Songs best matching a taste profile (any non-negative topic vector), best first,
+        as (song name, genre, score, Song id or None). The profile is normalized, so it
+        ranks like the average of the liked songs' distributions.
+        """
+        return self.similar_songs(profile, top_n, genres)
+
+    def related_songs_by_genre(self, topic_index, top_n=20):
+        """Top N related songs for the topic within each genre, as genre -> related songs."""
+        return {str(genre): self.related_songs(topic_index, top_n, genres=[genre])
+                for genre in np.unique(self.song_genres)}
+
+    def predict_song_topics(self, lyrics_list, top_n=20, by_genre=False):
+        P_z_new = self.topic_distributions(preprocess_many(lyrics_list))
+        top_indices = np.argmax(P_z_new, axis=1)
+        related = self.related_songs_by_genre if by_genre else self.related_songs
+
+        # Songs sharing a top topic share the same related songs
+        related_by_topic = {}
+        results = []
+        for row, top_index in enumerate(top_indices):
+            if top_index not in related_by_topic:
+                related_by_topic[top_index] = related(top_index, top_n)
+            results.append((top_index + 1, P_z_new[row, top_index], related_by_topic[top_index]))
+        return results
+
+    def predict_song_topic(self, new_lyrics, top_n=20):
+        top_topic, top_topic_probability, related_songs = self.predict_song_topics([new_lyrics], top_n)[0]
+        print(f"\nTop Topic for the New Song: Topic {top_topic} with Probability {top_topic_probability:.4f}")
+        return top_topic, top_topic_probability, related_songs
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_pointer_mtime = None
+
+
+def get_engine():
+    """Return the process-wide RecommenderEngine, building it on first use."""
+    global _engine, _pointer_mtime
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _pointer_mtime = release_pointer_mtime()
+                _engine = RecommenderEngine(current_release())
+    return _engine
+
+
+def reload_engine():
+    """
+    Swap in the current release if the pointer moved since the engine was built.
+    Called between requests (see apps.py). Costs one stat() when nothing changed.
+
+    The new engine is built while the old one keeps serving: requests already
+    holding it finish on it, and other threads do not wait for the swap.
+    """
+    global _engine, _pointer_mtime
+    if _engine is None or release_pointer_mtime() == _pointer_mtime:
+        return
+    if not _engine_lock.acquire(blocking=False):
+        # Another thread is already swapping
+        return
+    try:
+        mtime = release_pointer_mtime()
+        release = current_release()
+        if release is not None and release != _engine.release:
+            try:
+                _engine = RecommenderEngine(release)
+                print(f"Recommender engine switched to {release}.")
+            except Exception as e:
+                # Keep serving the old release; this one is not retried until the pointer moves again
+                print(f"Error loading release {release}: {e}")
+        _pointer_mtime = mtime
+    finally:
+        _engine_lock.release()
+
+
+def mark_song_ids_stale():
+    """
+    Called when the catalog changes. Rows built from the catalog already carry
+    exact Song ids; JSON corpus rows are matched by title and genre, so the
+    mapping is re-resolved on next use.
+    """
+    if _engine is not None and _engine.source == 'json':
+        _engine.song_ids_stale = True
+
+
+def model_version():
+    """Version of the recommender currently serving, or None if it cannot be loaded."""
+    try:
+        return get_engine().version
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        return None
+
+
+def predict_song_topic(new_lyrics, top_n=20):
+    """
+    Predict the top topic for a new song based on its lyrics, and find the most related songs in the corpus.
+
+    Args:
+    - new_lyrics (str): Lyrics of the new song to predict the topic for.
+    - top_n (int, optional): The number of top related songs to return. Defaults to 20.
+
+    Returns:
+    - Tuple containing the top topic for the new song, its probability, and the list of related songs
+      as (song name, genre, probability, Song id or None).
+    """
+    try:
+        engine = get_engine()
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        return None, None, []
+
+    return engine.predict_song_topic(new_lyrics, top_n)
+
+
+def predict_song_topics(lyrics_list, top_n=20, by_genre=False):
+    """
+    Batched predict_song_topic: preprocess, vectorize and project all lyrics in one pass.
+
+    Args:
+    - lyrics_list (list of str): Lyrics of the songs to predict topics for.
+    - top_n (int, optional): The number of top related songs to return per song. Defaults to 20.
+    - by_genre (bool, optional): Return the top N related songs within each genre, as a dict
+      genre -> related songs, instead of the top N overall.
+
+    Returns:
+    - List with one (top topic, probability, related songs) tuple per lyrics, in input order.
+    """
+    if not lyrics_list:
+        return []
+    try:
+        engine = get_engine()
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        return []
+
+    return engine.predict_song_topics(lyrics_list, top_n, by_genre)
@@ -1,3 +1,7 @@
+import hashlib
+import zlib
+import numpy as np
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.contrib.auth import get_user_model
@@ -75,21 +79,145 @@ class Song(models.Model):
     duration = models.DurationField(help_text="Duration of the song (e.g. 00:03:30)", blank=True, null=True)
     release_date = models.DateField(blank=True, null=True)
     genre = models.CharField(max_length=100, blank=True, null=True)
-    lyrics = models.TextField(blank=True, null=True)
     mp3_file = models.FileField(upload_to='mp3_files/', blank=True, null=True)  # MP3 upload field
+    # pLSA topic distribution of the lyrics (float32 bytes) against the fixed P(w|z)
+    topic_vector = models.BinaryField(blank=True, null=True, editable=False)
+    top_topic = models.PositiveSmallIntegerField(blank=True, null=True, editable=False,
+                                                 help_text="Most likely topic, numbered from 1")
+    lyrics_hash = models.CharField(max_length=40, blank=True, default='', editable=False)
+
+    TOPIC_FIELDS = ['topic_vector', 'top_topic', 'lyrics_hash']
+
+    # Lyrics live in SongLyrics; Song.lyrics reads them on first access
+    _lyrics = LYRICS_NOT_LOADED = object()
+    _lyrics_changed = False
+    _topic_vector_changed = False
+
+    @property
+    def lyrics(self):
+        """
+        The lyrics, or None. Loaded from SongLyrics on first access, which costs one
+        query unless the songs were fetched with select_related('lyrics_storage').
+        """
+        if self._lyrics is Song.LYRICS_NOT_LOADED:
+            try:
+                self._lyrics = self.lyrics_storage.text
+            except SongLyrics.DoesNotExist:
+                self._lyrics = None
+        return self._lyrics
+
+    @lyrics.setter
+    def lyrics(self, lyrics):
+        # Written to SongLyrics by save()
+        self._lyrics = lyrics
+        self._lyrics_changed = True
 
     def save(self, *args, **kwargs):
         if self.album and not self.genre:
             self.genre = self.album.genre
         if self.album and self.album.release_date:
             self.release_date = self.album.release_date
+        update_fields = kwargs.get('update_fields')
+        save_lyrics = self._lyrics_changed and (update_fields is None or 'lyrics' in update_fields)
+        if update_fields is not None:
+            update_fields = set(update_fields) - {'lyrics'}
+        # Recompute the topic vector only when the lyrics actually changed
+        self._topic_vector_changed = False
+        old_vector = self.topic_vector
+        if self._lyrics is not Song.LYRICS_NOT_LOADED and self.lyrics_hash != lyrics_digest(self.lyrics) \
+                and self.update_topic_vector():
+            # Taste profiles that include the old vector are rebuilt by signals.py
+            self._topic_vector_changed = self.topic_vector != old_vector
+            if update_fields is not None:
+                update_fields |= set(self.TOPIC_FIELDS)
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
         super().save(*args, **kwargs)
+        if save_lyrics:
+            SongLyrics.store(self, self._lyrics)
+            self._lyrics_changed = False
+
+    @property
+    def topic_distribution(self):
+        if self.topic_vector is None:
+            return None
+        return np.frombuffer(self.topic_vector, dtype=np.float32)
+
+    def set_topic_distribution(self, P_z):
+        if P_z is None:
+            self.topic_vector, self.top_topic = None, None
+        else:
+            self.topic_vector = np.asarray(P_z, dtype=np.float32).tobytes()
+            self.top_topic = int(np.argmax(P_z)) + 1
+        self.lyrics_hash = lyrics_digest(self.lyrics)
+
+    def update_topic_vector(self):
+        """Project the lyrics onto the pLSA topics. Returns False if the model is unavailable."""
+        if not self.lyrics:
+            self.set_topic_distribution(None)
+            return True
+        from .model import get_engine
+        try:
+            P_z = get_engine().topic_vectors([self.lyrics])[0]
+        except Exception as e:
+            # Model or preprocessing data unavailable: save the song anyway, lyrics_hash
+            # stays stale so the vector is computed on a later save or backfill
+            print(f"Error computing topic vector: {e}")
+            return False
+        self.set_topic_distribution(P_z)
+        return True
 
     def __str__(self):
         album_title = self.album.album_title if self.album else "No Album"
         return f"{self.song_title} by {self.artist.name} ({album_title})"
 
 
+def lyrics_digest(lyrics):
+    return hashlib.sha1((lyrics or '').encode('utf-8')).hexdigest()
+
+
+# Song lyrics
+# Kept out of music_song so that song lists never fetch them. One row per song
+# with lyrics, UTF-8 and zlib-compressed when settings.LYRICS_COMPRESSION is on
+class SongLyrics(models.Model):
+    song = models.OneToOneField(Song, related_name='lyrics_storage', primary_key=True, on_delete=models.CASCADE)
+    data = models.BinaryField()
+    compressed = models.BooleanField(default=False)
+
+    @property
+    def text(self):
+        data = bytes(self.data)
+        return (zlib.decompress(data) if self.compressed else data).decode('utf-8')
+
+    @text.setter
+    def text(self, text):
+        self.data, self.compressed = encode_lyrics(text)
+
+    @classmethod
+    def store(cls, song, lyrics):
+        """Write (or, for empty lyrics, delete) the song's lyrics row."""
+        if not lyrics:
+            cls.objects.filter(song=song).delete()
+            return None
+        song_lyrics = cls(song=song)
+        song_lyrics.text = lyrics
+        song_lyrics.save()
+        return song_lyrics
+
+    def __str__(self):
+        return f"Lyrics of {self.song_id}"
+
+
+def encode_lyrics(text):
+    """(data, compressed) as stored in SongLyrics; compressed only if that is smaller."""
+    data = text.encode('utf-8')
+    if getattr(settings, 'LYRICS_COMPRESSION', True):
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return packed, True
+    return data, False
+
+
 # Playlist
 class Playlist(models.Model):
     user = models.ForeignKey(get_user_model(), related_name='playlists', on_delete=models.CASCADE)
@@ -110,3 +238,65 @@ def add_to_favorites(user, song):
     favorites, created = Playlist.objects.get_or_create(user=user, name="Favorites")
     favorites.songs.add(song)
     return favorites
+
+
+# Recommendations
+# Materialized per-user recommendations, recomputed when the Favorites playlist or the model changes
+class UserRecommendation(models.Model):
+    user = models.ForeignKey(get_user_model(), related_name='recommendations', on_delete=models.CASCADE)
+    song = models.ForeignKey(Song, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+    rank = models.PositiveIntegerField()
+    model_version = models.CharField(max_length=64)
+
+    class Meta:
+        ordering = ['rank']
+        indexes = [models.Index(fields=['user', 'rank'])]
+
+    def __str__(self):
+        return f"#{self.rank} {self.song.song_title} for {self.user.username}"
+
+
+# Taste profile
+# Running sum of the topic vectors of a user's Favorites, updated as songs are liked and unliked
+class TasteProfile(models.Model):
+    user = models.OneToOneField(get_user_model(), related_name='taste_profile', on_delete=models.CASCADE)
+    topic_vector = models.BinaryField(blank=True, null=True)  # float64 bytes
+    song_count = models.PositiveIntegerField(default=0)  # Favorites that contributed a topic vector
+    genre_counts = models.JSONField(default=dict, blank=True)  # Genre -> number of Favorites
+    # Model version the user's UserRecommendation rows were last computed with, even if none came out
+    recommendations_version = models.CharField(max_length=64, blank=True, default='')
+
+    @property
+    def vector(self):
+        if self.topic_vector is None:
+            return None
+        return np.frombuffer(self.topic_vector, dtype=np.float64)
+
+    @property
+    def liked_genres(self):
+        return [genre for genre, count in self.genre_counts.items() if count > 0]
+
+    def reset(self):
+        self.topic_vector, self.song_count, self.genre_counts = None, 0, {}
+
+    def add_songs(self, songs, sign=1):
+        """Add (sign=1) or subtract (sign=-1) the songs' contribution, in O(topics) per song."""
+        vector = self.vector.copy() if self.topic_vector is not None else None
+        for song in songs:
+            genre = song.genre or ''
+            self.genre_counts[genre] = self.genre_counts.get(genre, 0) + sign
+            P_z = song.topic_distribution
+            if P_z is None:
+                continue
+            if vector is None or len(vector) != len(P_z):
+                vector = np.zeros(len(P_z))
+            vector += sign * P_z
+            self.song_count += sign
+        self.genre_counts = {genre: count for genre, count in self.genre_counts.items() if count > 0}
+        self.topic_vector = vector.tobytes() if vector is not None and self.song_count > 0 else None
+        if self.topic_vector is None:
+            self.song_count = 0
+
+    def __str__(self):
+        return f"Taste profile of {self.user.username}"
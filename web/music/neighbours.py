@@ -0,0 +1,180 @@
+# Precomputed "more like this" neighbours
+import hashlib
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .ann import IVFIndex, transform
+from .model import _atomic_save, artifact_path, catalog_corpus
+
+
+# Neighbours kept per song by default
+NEIGHBOURS_PER_SONG = 20
+
+# Past this share of changed songs an incremental run rebuilds everything instead
+INCREMENTAL_MAX_CHANGED = 0.5
+
+
+def neighbour_dtype(k):
+    """
+    One row per Song id: the K nearest Song ids (-1 padded), their Hellinger
+    similarities and a digest of the topic vector they were computed from
+    (0 for songs without one).
+    """
+    return np.dtype([('ids', '<i4', (k,)), ('scores', '<f2', (k,)), ('digest', '<u8')])
+
+
+def vector_digests(vectors):
+    return np.array([
+        int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), 'little')
+        for row in np.asarray(vectors, dtype=np.float32)
+    ], dtype=np.uint64)
+
+
+def best_columns(scores, ids, k):
+    """Top k (ids, scores) per row of the score matrix, best first; -inf entries become -1 ids."""
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best, best_scores = np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+    best_ids = np.take_along_axis(np.broadcast_to(ids, scores.shape), best, axis=1)
+    missing = np.isneginf(best_scores)
+    return np.where(missing, -1, best_ids), np.where(missing, 0, best_scores)
+
+
+def exact_neighbours(rows, X, ids, k, batch_size=1024):
+    """Neighbours of X[rows] among all of X, excluding each song itself."""
+    result_ids = np.full((len(rows), k), -1, dtype=np.int32)
+    result_scores = np.zeros((len(rows), k), dtype=np.float16)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        scores = X[batch] @ X.T
+        scores[np.arange(len(batch)), batch] = -np.inf
+        best_ids, best_scores = best_columns(scores, ids, k)
+        result_ids[start:start + len(batch), :best_ids.shape[1]] = best_ids
+        result_scores[start:start + len(batch), :best_ids.shape[1]] = best_scores
+    return result_ids, result_scores
+
+
+def approximate_neighbours(rows, vectors, ids, k):
+    """Neighbours of the given rows from an IVF index, for catalogs too large for exact search."""
+    index = IVFIndex().build(vectors)
+    result_ids = np.full((len(rows), k), -1, dtype=np.int32)
+    result_scores = np.zeros((len(rows), k), dtype=np.float16)
+    for i, row in enumerate(rows):
+        found, scores = index.search(vectors[row], k + 1)
+        keep = found != row
+        found, scores = found[keep][:k], scores[keep][:k]
+        result_ids[i, :len(found)] = ids[found]
+        result_scores[i, :len(found)] = scores
+    return result_ids, result_scores
+
+
+def neighbours_for_rows(rows, vectors, X, ids, k):
+    if len(ids) >= settings.RECOMMENDER_ANN_MIN_ROWS:
+        return approximate_neighbours(rows, vectors, ids, k)
+    return exact_neighbours(rows, X, ids, k)
+
+
+def load_neighbours():
+    """Memory-map the neighbour table, reloading it when the file is rebuilt. None if it was never built."""
+    global _neighbours, _neighbours_mtime
+    path = artifact_path('song_neighbours.npy')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _neighbours is None or mtime != _neighbours_mtime:
+        _neighbours, _neighbours_mtime = np.load(path, mmap_mode='r'), mtime
+    return _neighbours
+
+
+_neighbours = None
+_neighbours_mtime = None
+
+
+def build_neighbours(k=NEIGHBOURS_PER_SONG, changed_only=False):
+    """
+    Compute the K nearest songs of every song with a stored topic vector and write
+    them to one memory-mappable table indexed by Song id.
+
+    With changed_only, only songs whose vector changed (or that are new), and songs
+    that had one of those or a deleted song as a neighbour, are recomputed; every
+    other list merges in the changed songs. Returns (songs recomputed, songs in the table).
+    """
+    corpus = catalog_corpus()
+    if corpus is None:
+        return 0, 0
+    vectors, (titles, genres, ids) = corpus
+    vectors = vectors.astype(np.float32)
+    X = transform(vectors)
+    digests = vector_digests(vectors)
+
+    previous = load_neighbours() if changed_only else None
+    if previous is not None and previous.dtype != neighbour_dtype(k):
+        previous = None
+    size = max(int(ids.max()) + 1, len(previous) if previous is not None else 0)
+    table = np.zeros(size, dtype=neighbour_dtype(k))
+    table['ids'] = -1
+
+    if previous is None:
+        changed = np.ones(len(ids), dtype=bool)
+    else:
+        table[:len(previous)] = previous
+        changed = table['digest'][ids] != digests
+    if changed.mean() > INCREMENTAL_MAX_CHANGED:
+        changed[:] = True
+
+    # Songs that lost their vector or were deleted keep no list
+    stale = np.flatnonzero(table['digest'])
+    stale = stale[~np.isin(stale, ids[~changed])]
+    table[stale] = np.zeros(1, dtype=table.dtype)
+    table['ids'][stale] = -1
+
+    # Lists that lost a neighbour cannot be refilled from what they kept, so they are recomputed too
+    lost = np.isin(table['ids'][ids], stale).any(axis=1)
+    recompute_rows = np.flatnonzero(changed | lost)
+    table['ids'][ids[recompute_rows]], table['scores'][ids[recompute_rows]] = \
+        neighbours_for_rows(recompute_rows, vectors, X, ids, k)
+    table['digest'][ids] = digests
+
+    # The remaining lists are still exact once the changed songs are merged in
+    changed_rows = np.flatnonzero(changed)
+    unchanged_rows = np.flatnonzero(~(changed | lost))
+    if len(unchanged_rows) and len(changed_rows):
+        for start in range(0, len(unchanged_rows), 1024):
+            batch = unchanged_rows[start:start + 1024]
+            old_ids = table['ids'][ids[batch]]
+            old_scores = table['scores'][ids[batch]].astype(np.float32)
+            old_scores[old_ids < 0] = -np.inf
+            scores = np.hstack([old_scores, X[batch] @ X[changed_rows].T])
+            candidates = np.hstack([old_ids, np.broadcast_to(ids[changed_rows], (len(batch), len(changed_rows)))])
+            best_ids, best_scores = best_columns(scores, candidates, k)
+            table['ids'][ids[batch]] = -1
+            table['scores'][ids[batch]] = 0
+            table['ids'][ids[batch], :best_ids.shape[1]] = best_ids
+            table['scores'][ids[batch], :best_ids.shape[1]] = best_scores
+
+    _atomic_save(artifact_path('song_neighbours.npy'), np.save, table)
+    return len(recompute_rows), len(ids)
+
+
+def song_neighbours(song_id):
+    """(Song id, similarity) pairs nearest to the song, best first, read straight from the table."""
+    table = load_neighbours()
+    if table is None or not 0 <= song_id < len(table):
+        return []
+    row = table[song_id]
+    return [(neighbour_id, score) for neighbour_id, score in zip(row['ids'].tolist(), row['scores'].tolist())
+            if neighbour_id >= 0]
+
+
+def similar_songs(song):
+    """The song's precomputed neighbours as (Song, similarity) pairs, best first."""
+    from .models import Song
+
+    neighbours = song_neighbours(song.id)
+    songs = Song.objects.select_related('artist', 'album').in_bulk([song_id for song_id, score in neighbours])
+    return [(songs[song_id], score) for song_id, score in neighbours if song_id in songs]
@@ -0,0 +1,152 @@
+# pLSA training
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import sparse
+
+# Entries of the document-term matrix processed at once when computing P(d,w)
+NNZ_BLOCK = 1 << 18
+
+
+def csr_rows(X):
+    """Row of every stored entry of the CSR matrix X, in storage order."""
+    return np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+
+
+def pair_probabilities(rows, cols, D, P_w_z):
+    """
+    Model probability sum_z P(z) P(d|z) P(w|z) of the (d, w) pairs, where
+    D = P(d|z) P(z). Only a block of pairs x topics values is in memory at a time.
+    """
+    probabilities = np.empty(len(rows))
+    for start in range(0, len(rows), NNZ_BLOCK):
+        block = slice(start, start + NNZ_BLOCK)
+        probabilities[block] = np.einsum('ij,ij->i', D[rows[block]], P_w_z[cols[block]])
+    return np.maximum(probabilities, 1e-300)
+
+
+def e_step(X, D, P_w_z):
+    """
+    Expected counts for one block of documents, without forming the documents x
+    words x topics posterior. With Q[d, w] = n(d, w) / P(d, w):
+
+        sum_d n(d, w) P(z|d, w) = P(w|z) * (Q^T D)[w, z]
+        sum_w n(d, w) P(z|d, w) = D[d, z] * (Q P(w|z))[d, z]
+
+    Returns the word-topic and document-topic expected counts and the log-likelihood.
+    X must be in CSR format; Q reuses its structure.
+    """
+    rows = csr_rows(X)
+    probabilities = pair_probabilities(rows, X.indices, D, P_w_z)
+    Q = sparse.csr_matrix((X.data / probabilities, X.indices, X.indptr), shape=X.shape)
+    word_counts = P_w_z * (Q.T @ D)
+    doc_counts = D * (Q @ P_w_z)
+    return word_counts, doc_counts, float(X.data @ np.log(probabilities))
+
+
+def fold_in(X, P_w_z, max_iter=20, tol=1e-4, P_z_d=None):
+    """
+    pLSA fold-in: P(z|d) of new documents by EM with P(w|z) held fixed, for the
+    whole batch at once. Starts from P_z_d (by default the projection X @ P(w|z))
+    and stops once no probability moves by more than tol, or after max_iter
+    iterations. Documents without known words keep a zero row.
+    """
+    X = sparse.csr_matrix(X, dtype=np.float64)
+    rows = csr_rows(X)
+    if P_z_d is None:
+        P_z_d = np.asarray(X @ P_w_z)
+    P_z_d = np.array(P_z_d, dtype=np.float64)
+    row_sums = P_z_d.sum(axis=1, keepdims=True)
+    P_z_d = np.divide(P_z_d, row_sums, out=np.zeros_like(P_z_d), where=row_sums > 0)
+
+    for iteration in range(max_iter):
+        probabilities = pair_probabilities(rows, X.indices, P_z_d, P_w_z)
+        Q = sparse.csr_matrix((X.data / probabilities, X.indices, X.indptr), shape=X.shape)
+        updated = P_z_d * (Q @ P_w_z)
+        row_sums = updated.sum(axis=1, keepdims=True)
+        updated = np.divide(updated, row_sums, out=np.zeros_like(updated), where=row_sums > 0)
+        converged = np.abs(updated - P_z_d).max(initial=0) <= tol
+        P_z_d = updated
+        if converged:
+            break
+    return P_z_d
+
+
+_worker_X = None
+
+
+def _init_worker(X):
+    global _worker_X
+    _worker_X = X
+
+
+def _e_step_block(args):
+    start, end, D, P_w_z = args
+    return e_step(_worker_X[start:end], D, P_w_z)
+
+
+def initial_model(X, n_topics, warm_start=None, seed=0):
+    """
+    Random initial P(d|z), P(w|z), P(z), or the warm start model. A warm start keeps
+    P(w|z) and P(z); P(d|z) is reused if the documents match, else folded in from X.
+    """
+    n_docs, n_words = X.shape
+    if warm_start is not None:
+        P_d_z, P_w_z, P_z = (np.array(P, dtype=np.float64) for P in warm_start)
+        if P_w_z.shape != (n_words, n_topics):
+            raise ValueError(f"Warm start P_w_z has shape {P_w_z.shape}, expected {(n_words, n_topics)}")
+        if P_d_z.shape != (n_docs, n_topics):
+            P_d_z = np.asarray(X @ P_w_z) + 1e-12
+            P_d_z /= P_d_z.sum(axis=0, keepdims=True)
+        return P_d_z, P_w_z, P_z
+
+    rng = np.random.default_rng(seed)
+    P_d_z = rng.random((n_docs, n_topics))
+    P_w_z = rng.random((n_words, n_topics))
+    P_d_z /= P_d_z.sum(axis=0, keepdims=True)
+    P_w_z /= P_w_z.sum(axis=0, keepdims=True)
+    return P_d_z, P_w_z, np.full(n_topics, 1 / n_topics)
+
+
+def train(X, n_topics=10, max_iter=100, tol=1e-5, warm_start=None, processes=1, seed=0, log=print):
+    """
+    Fit symmetric pLSA, P(d, w) = sum_z P(z) P(d|z) P(w|z), to the sparse
+    document-term matrix X by EM. Stops after max_iter iterations or once the
+    relative log-likelihood gain drops below tol. With processes > 1 each E-step
+    is split by blocks of documents over a process pool.
+
+    Returns (P_d_z, P_w_z, P_z), as stored by model.save_model, and the log-likelihood.
+    """
+    X = sparse.csr_matrix(X, dtype=np.float64)
+    P_d_z, P_w_z, P_z = initial_model(X, n_topics, warm_start, seed)
+    bounds = np.linspace(0, X.shape[0], max(processes, 1) + 1).astype(int)
+    blocks = [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+    pool = Pool(processes, initializer=_init_worker, initargs=(X,)) if len(blocks) > 1 else None
+    log_likelihood = -np.inf
+    try:
+        for iteration in range(1, max_iter + 1):
+            D = P_d_z * P_z
+            if pool is None:
+                results = [e_step(X, D, P_w_z)]
+            else:
+                results = pool.map(_e_step_block, [(start, end, D[start:end], P_w_z) for start, end in blocks])
+
+            # M-step: renormalize the expected counts
+            word_counts = sum(result[0] for result in results)
+            doc_counts = np.vstack([result[1] for result in results])
+            previous, log_likelihood = log_likelihood, sum(result[2] for result in results)
+            topic_counts = word_counts.sum(axis=0)
+            P_w_z = word_counts / np.maximum(topic_counts, 1e-300)
+            P_d_z = doc_counts / np.maximum(doc_counts.sum(axis=0), 1e-300)
+            P_z = topic_counts / topic_counts.sum()
+
+            log(f"Iteration {iteration}: log-likelihood {log_likelihood:.4f}")
+            if np.isfinite(previous) and abs(log_likelihood - previous) <= tol * abs(previous):
+                break
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return (P_d_z, P_w_z, P_z), log_likelihood
+
@@ -0,0 +1,73 @@
+# Lyrics preprocessing
+import re
+from functools import lru_cache
+from multiprocessing import Pool
+
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+
+
+nltk.download('stopwords')
+
+# Upper bound on memoized stems; lyrics vocabularies are small, so hits dominate
+STEM_CACHE_SIZE = 2 ** 16
+
+NON_LETTERS = re.compile(r'[^a-zA-Z\s]')
+WORDS = re.compile(r'[a-z]+')
+
+# Once the text is reduced to lowercase letters and whitespace, the only thing
+# NLTK's word_tokenize still does beyond splitting on whitespace is break up
+# these contractions (see MacIntyreContractions.CONTRACTIONS2).
+CONTRACTIONS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+stemmer = PorterStemmer()
+stem = lru_cache(maxsize=STEM_CACHE_SIZE)(stemmer.stem)
+
+
+@lru_cache(maxsize=None)
+def stop_words():
+    return frozenset(stopwords.words('english'))
+
+
+def tokenize(lyrics):
+    """Split cleaned, lowercased lyrics into the same tokens word_tokenize would produce."""
+    tokens = []
+    for word in WORDS.findall(lyrics):
+        if word in CONTRACTIONS:
+            tokens.extend(CONTRACTIONS[word])
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def preprocess_lyrics(lyrics):
+    # Check if the lyrics are valid (not null and are strings)
+    if not isinstance(lyrics, str):
+        # If not a valid string, return an empty string
+        return ''
+
+    # Remove special characters, numbers, etc. and convert to lowercase
+    lyrics = NON_LETTERS.sub('', lyrics).lower()
+
+    # Tokenize, remove stopwords and stem
+    english_stop_words = stop_words()
+    return ' '.join(stem(word) for word in tokenize(lyrics) if word not in english_stop_words)
+
+
+def preprocess_many(lyrics_list, processes=1, chunksize=64):
+    """
+    Preprocess a batch of lyrics, in order. With processes > 1 the batch is spread
+    over a process pool, which pays off when rebuilding the whole corpus.
+    """
+    if processes > 1 and len(lyrics_list) > chunksize:
+        with Pool(processes) as pool:
+            return pool.map(preprocess_lyrics, lyrics_list, chunksize=chunksize)
+    return [preprocess_lyrics(lyrics) for lyrics in lyrics_list]
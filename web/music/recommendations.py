@@ -0,0 +1,210 @@
+# Recommendations
+import heapq
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .model import get_engine, model_version, predict_song_topics
+from .models import Playlist, Song, TasteProfile, UserRecommendation, lyrics_digest
+
+
+# Cache alias holding each song's related songs, see CACHES in settings
+SONG_CACHE_ALIAS = 'recommendations'
+
+# Number of songs recommended to each user
+RECOMMENDATIONS_PER_PAGE = 20
+
+
+class SongRecommendationCache:
+    """
+    Memo of each song's related songs, shared by every user who liked it. They
+    are kept per genre (genre -> top N in that genre) so that each user can
+    merge just the genres they like.
+
+    Keys carry the song id, the hash of the lyrics and the model version, so
+    editing the lyrics or rebuilding the model simply stops hitting old entries;
+    the cache backend's LRU eviction (MAX_ENTRIES) ages them out.
+
+    Hit and miss counters live in the cache backend too, so with a shared
+    backend they cover every worker (views.query_stats shows them).
+    """
+
+    STATS_KEYS = {'hits': 'song-related:stats:hits', 'misses': 'song-related:stats:misses'}
+
+    def __init__(self, alias=SONG_CACHE_ALIAS):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, song, version, top_n):
+        # Hash the lyrics themselves: lyrics_hash lags behind when the topic vector could not be recomputed
+        return f"song-related:v3:{song.id}:{lyrics_digest(song.lyrics)}:{version}:{top_n}"
+
+    def related_songs(self, songs, top_n=20):
+        """Map song id -> related songs by genre for every song with lyrics, predicting only the misses in one batch."""
+        songs = [song for song in songs if song.lyrics]
+        version = model_version()
+        keys = {song.id: self.key(song, version, top_n) for song in songs}
+        cached = self.cache.get_many(keys.values())
+
+        results = {}
+        missing = []
+        for song in songs:
+            if keys[song.id] in cached:
+                results[song.id] = cached[keys[song.id]]
+            else:
+                missing.append(song)
+        self.count('hits', len(results))
+        self.count('misses', len(missing))
+
+        if not missing:
+            return results
+        predictions = predict_song_topics([song.lyrics for song in missing], top_n, by_genre=True)
+        if predictions:
+            fresh = {song.id: related for song, (top_topic, probability, related) in zip(missing, predictions)}
+            self.cache.set_many({keys[song_id]: related for song_id, related in fresh.items()})
+            results.update(fresh)
+        return results
+
+    def count(self, name, n):
+        if not n:
+            return
+        key = self.STATS_KEYS[name]
+        try:
+            self.cache.incr(key, n)
+        except ValueError:
+            # First lookup, or the counter was evicted
+            if not self.cache.add(key, n, timeout=None):
+                self.cache.incr(key, n)
+
+    def stats(self):
+        counts = self.cache.get_many(self.STATS_KEYS.values())
+        hits = counts.get(self.STATS_KEYS['hits'], 0)
+        misses = counts.get(self.STATS_KEYS['misses'], 0)
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
+
+
+song_recommendations = SongRecommendationCache()
+
+
+def liked_songs(user):
+    return Song.objects.filter(playlists__user=user, playlists__name="Favorites")
+
+
+def rebuild_taste_profile(user):
+    """Recompute the user's taste profile from scratch, from every song in their Favorites."""
+    profile, created = TasteProfile.objects.get_or_create(user=user)
+    profile.reset()
+    profile.add_songs(liked_songs(user).only('genre', 'topic_vector'))
+    profile.save()
+    return profile
+
+
+def update_taste_profile(user, song_ids, sign=1):
+    """Add (sign=1) or remove (sign=-1) Favorites songs from the user's taste profile."""
+    profile = TasteProfile.objects.filter(user=user).first()
+    if profile is None:
+        # First change since profiles were introduced, the Favorites already reflect it
+        return rebuild_taste_profile(user)
+    profile.add_songs(Song.objects.filter(id__in=song_ids).only('genre', 'topic_vector'), sign)
+    profile.save()
+    return profile
+
+
+def profile_recommendations(profile):
+    """Song id -> score for the catalog scored against the user's taste profile."""
+    try:
+        engine = get_engine()
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        return {}
+    if len(profile.vector) != engine.P_z_corpus.shape[1]:
+        profile = rebuild_taste_profile(profile.user)
+        if profile.vector is None:
+            return {}
+    related = engine.score_profile(profile.vector, RECOMMENDATIONS_PER_PAGE, profile.liked_genres)
+    return {song_id: score for song_name, genre, score, song_id in related if song_id is not None}
+
+
+def favorites_recommendations(user):
+    """Song id -> score merged from each favorite's own related songs, for favorites without stored vectors."""
+    favorites_playlist = Playlist.objects.filter(user=user, name="Favorites").first()
+    if favorites_playlist is None:
+        return {}
+    favorite_songs = list(favorites_playlist.songs.select_related('lyrics_storage'))
+    # Collect the genres of the liked songs
+    liked_genres = {song.genre or '' for song in favorite_songs}
+
+    # Every favorite contributes one pre-sorted run per liked genre; merging them
+    # yields the best songs first, so the page fills up without over-fetching
+    runs = [
+        related_by_genre[genre]
+        for related_by_genre in song_recommendations.related_songs(favorite_songs).values()
+        for genre in liked_genres if genre in related_by_genre
+    ]
+    scores = {}
+    for song_name, genre, probability, song_id in heapq.merge(*runs, key=lambda related: -related[2]):
+        if song_id is not None and song_id not in scores:
+            scores[song_id] = probability
+            if len(scores) == RECOMMENDATIONS_PER_PAGE:
+                break
+    return scores
+
+
+def compute_recommendations(user):
+    """Recommended songs for the user's Favorites as (song, score) pairs, best first."""
+    profile = TasteProfile.objects.filter(user=user).first()
+    if profile is not None and profile.song_count:
+        scores = profile_recommendations(profile)
+    else:
+        scores = favorites_recommendations(user)
+    if not scores:
+        return []
+
+    songs = Song.objects.filter(id__in=scores).select_related('album', 'artist')
+    return sorted(((song, scores[song.id]) for song in songs), key=lambda pair: -pair[1])
+
+
+def refresh_user_recommendations(user, version=None):
+    """Recompute the user's UserRecommendation rows in one transaction."""
+    version = version or model_version()
+    rows = [
+        UserRecommendation(user=user, song=song, score=score, rank=rank, model_version=version or '')
+        for rank, (song, score) in enumerate(compute_recommendations(user), start=1)
+    ]
+    with transaction.atomic():
+        UserRecommendation.objects.filter(user=user).delete()
+        UserRecommendation.objects.bulk_create(rows)
+        # Remembers that an empty result is up to date too
+        TasteProfile.objects.filter(user=user).update(recommendations_version=version or '')
+
+
+def user_recommendations(user):
+    """
+    The user's last computed recommendations, with song, album and artist in one
+    joined query. Only recomputed here if the model version changed (the taste
+    profile is rebuilt too, as song vectors may have been recomputed) or nothing
+    has been computed yet; Favorites changes refresh them eagerly (see signals.py).
+    """
+    recommendations = UserRecommendation.objects.filter(user=user).select_related('song__album', 'song__artist')
+    rows = list(recommendations)
+    version = model_version() or ''
+    if rows:
+        stale = any(row.model_version != version for row in rows)
+    else:
+        # No rows: either computed and empty for this version, or never computed
+        computed = TasteProfile.objects.filter(user=user).values_list('recommendations_version', flat=True).first()
+        stale = computed != version and Playlist.objects.filter(
+            user=user, name="Favorites", songs__isnull=False).exists()
+    if stale:
+        rebuild_taste_profile(user)
+        refresh_user_recommendations(user, version)
+        rows = list(recommendations)
+    return rows
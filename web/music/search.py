@@ -0,0 +1,136 @@
+# Song search
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Song, SongLyrics
+
+
+# FTS5 table over song title, artist name, album title and lyrics, rowid = Song id.
+# Created by migration 0016 (SQLite only) and kept in sync by signals.py
+SEARCH_TABLE = 'music_songsearch'
+
+# Relative weight of a match in each column for BM25 ranking
+COLUMN_WEIGHTS = {'title': 10.0, 'artist': 5.0, 'album': 3.0, 'lyrics': 1.0}
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Words of a query that are searched for, the rest are ignored
+MAX_QUERY_TERMS = 8
+
+# Shorter words only match whole words: a 2-letter prefix matches a large part
+# of any catalog, and BM25 has to score every match before the limit applies
+PREFIX_MIN_LENGTH = 3
+
+INDEX_BATCH_SIZE = 500
+
+WORDS = re.compile(r'\w+')
+
+
+def search_available():
+    return connection.vendor == 'sqlite'
+
+
+def index_lyrics():
+    return getattr(settings, 'SEARCH_INDEX_LYRICS', True)
+
+
+def query_terms(query):
+    return WORDS.findall(query.lower())[:MAX_QUERY_TERMS]
+
+
+def match_expression(terms, lyrics=False):
+    """FTS5 query matching songs that have every term as a word prefix (or word, if short)."""
+    expression = ' '.join(f'"{term}"*' if len(term) >= PREFIX_MIN_LENGTH else f'"{term}"' for term in terms)
+    if lyrics:
+        return expression
+    return f'{{title artist album}} : ({expression})'
+
+
+def find_songs(query, limit=SEARCH_DEFAULT_LIMIT, lyrics=False):
+    """
+    Songs matching every word of the query as a word prefix, in title, artist or album
+    (and lyrics, if asked), best first, with their artist and album. BM25 ranks
+    the matches, a title match weighing most.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    songs = Song.objects.select_related('artist', 'album')
+
+    if not search_available():
+        # No FTS5: substring matches on the same fields, by title
+        for term in terms:
+            songs = songs.filter(Q(song_title__icontains=term) | Q(artist__name__icontains=term)
+                                 | Q(album__album_title__icontains=term))
+        return list(songs.order_by('song_title', 'id')[:limit])
+
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS.values())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            f"ORDER BY bm25({SEARCH_TABLE}, {weights}), rowid LIMIT %s",
+            [match_expression(terms, lyrics), limit])
+        song_ids = [song_id for song_id, in cursor.fetchall()]
+    found = songs.in_bulk(song_ids)
+    return [found[song_id] for song_id in song_ids if song_id in found]
+
+
+# Index maintenance
+def index_rows(song_ids):
+    """(rowid, title, artist, album, lyrics) for each of the songs."""
+    songs = Song.objects.filter(id__in=song_ids).values_list('id', 'song_title', 'artist__name', 'album__album_title')
+    lyrics = {}
+    if index_lyrics():
+        lyrics = {song_lyrics.song_id: song_lyrics.text
+                  for song_lyrics in SongLyrics.objects.filter(song_id__in=song_ids)}
+    return [(song_id, title, artist or '', album or '', lyrics.get(song_id, ''))
+            for song_id, title, artist, album in songs]
+
+
+def index_songs(song_ids):
+    """(Re)index the songs; ids of songs that no longer exist are dropped from the index."""
+    if not search_available():
+        return
+    song_ids = list(song_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(song_ids), INDEX_BATCH_SIZE):
+            batch = song_ids[start:start + INDEX_BATCH_SIZE]
+            cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(song_id,) for song_id in batch])
+            cursor.executemany(f"INSERT INTO {SEARCH_TABLE} (rowid, title, artist, album, lyrics) "
+                               f"VALUES (%s, %s, %s, %s, %s)", index_rows(batch))
+
+
+def unindex_songs(song_ids):
+    if not search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(song_id,) for song_id in song_ids])
+
+
+def rebuild_index(batch_size=2000):
+    """Index every song from scratch (after bulk_create, queryset updates or a SEARCH_INDEX_LYRICS change)."""
+    if not search_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    indexed = 0
+    last_id = 0
+    while True:
+        # Page by primary key so each batch is one index range
+        song_ids = list(Song.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not song_ids:
+            break
+        last_id = song_ids[-1]
+        with connection.cursor() as cursor:
+            cursor.executemany(f"INSERT INTO {SEARCH_TABLE} (rowid, title, artist, album, lyrics) "
+                               f"VALUES (%s, %s, %s, %s, %s)", index_rows(song_ids))
+        indexed += len(song_ids)
+    with connection.cursor() as cursor:
+        # Merge the index segments the inserts left behind
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    return indexed
@@ -0,0 +1,129 @@
+from django.core.signals import request_started
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .model import mark_song_ids_stale, reload_engine
+from .catalog import bump_catalog_version
+from .models import Album, Artist, Playlist, Song, SongLyrics, TasteProfile, UserRecommendation
+from .recommendations import rebuild_taste_profile, refresh_user_recommendations, update_taste_profile
+from .search import index_lyrics, index_songs, unindex_songs
+
+
+# Recommender releases
+@receiver(request_started)
+def recommender_release_check(sender, **kwargs):
+    # Between requests: pick up a release published by build_recommender
+    reload_engine()
+
+
+# Catalog
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def catalog_changed(sender, instance, **kwargs):
+    # Retire every cached catalog read (see catalog.py)
+    bump_catalog_version()
+
+
+# Search index
+# Queryset update() and bulk_create() bypass these, run `manage.py rebuild_search_index` after them
+@receiver(post_save, sender=Song)
+def song_saved_search(sender, instance, **kwargs):
+    index_songs([instance.pk])
+
+
+@receiver(post_delete, sender=Song)
+def song_deleted_search(sender, instance, **kwargs):
+    unindex_songs([instance.pk])
+
+
+@receiver(post_save, sender=SongLyrics)
+@receiver(post_delete, sender=SongLyrics)
+def song_lyrics_changed_search(sender, instance, **kwargs):
+    # Song.save() writes the lyrics after the song itself
+    if index_lyrics():
+        index_songs([instance.song_id])
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Album)
+def artist_or_album_saved_search(sender, instance, created, **kwargs):
+    # Their name is indexed with each of their songs
+    if not created:
+        index_songs(instance.songs.values_list('id', flat=True))
+
+
+# Songs
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def song_changed(sender, instance, **kwargs):
+    # Corpus rows are mapped to songs by id; the mapping may have moved
+    mark_song_ids_stale()
+
+
+@receiver(post_save, sender=Song)
+def song_vector_changed(sender, instance, created, **kwargs):
+    # Taste profiles are sums of their Favorites' vectors: rebuild the ones that
+    # still hold this song's old vector, and their recommendations with them
+    if created or not instance._topic_vector_changed:
+        return
+    instance._topic_vector_changed = False
+    for playlist in Playlist.objects.filter(name="Favorites", songs=instance).select_related('user'):
+        rebuild_taste_profile(playlist.user)
+        refresh_user_recommendations(playlist.user)
+
+
+# Playlist songs
+def playlist_song_links(sender, instance, reverse, pk_set):
+    """(playlist id, song id) pairs currently linking instance to pk_set (or to anything, if None)."""
+    if reverse:
+        links = sender.objects.filter(song_id=instance.pk)
+        if pk_set is not None:
+            links = links.filter(playlist_id__in=pk_set)
+    else:
+        links = sender.objects.filter(playlist_id=instance.pk)
+        if pk_set is not None:
+            links = links.filter(song_id__in=pk_set)
+    return list(links.values_list('playlist_id', 'song_id'))
+
+
+@receiver(m2m_changed, sender=Playlist.songs.through)
+def playlist_songs_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # remove() reports every requested id and clear() none, so record what is actually unlinked beforehand
+    if action in ('pre_remove', 'pre_clear'):
+        instance._unlinked_songs = playlist_song_links(sender, instance, reverse,
+                                                       pk_set if action == 'pre_remove' else None)
+        return
+    if action == 'post_add':
+        # pk_set only holds the newly added ids here
+        links = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+        sign = 1
+    elif action in ('post_remove', 'post_clear'):
+        links = getattr(instance, '_unlinked_songs', [])
+        sign = -1
+    else:
+        return
+    if not links:
+        return
+
+    # auto_now does not fire for m2m changes
+    playlists = Playlist.objects.filter(pk__in={playlist_id for playlist_id, song_id in links})
+    playlists.update(updated_at=timezone.now())
+
+    # Recommendations are derived from the Favorites playlist: update the taste
+    # profile by the songs that changed and refresh them now, not on the next page view
+    for playlist in playlists.filter(name="Favorites").select_related('user'):
+        song_ids = [song_id for playlist_id, song_id in links if playlist_id == playlist.pk]
+        update_taste_profile(playlist.user, song_ids, sign)
+        refresh_user_recommendations(playlist.user)
+
+
+@receiver(post_delete, sender=Playlist)
+def playlist_deleted(sender, instance, **kwargs):
+    if instance.name == "Favorites":
+        UserRecommendation.objects.filter(user_id=instance.user_id).delete()
+        TasteProfile.objects.filter(user_id=instance.user_id).delete()
@@ -1,3 +1,886 @@
-from django.test import TestCase
+import json
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import nltk
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+from nltk.tokenize import NLTKWordTokenizer, word_tokenize
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+from . import middleware, model, neighbours, plsa, search, urls
+from .ann import IVFIndex, exact_search, transform
+from .corpus import StreamingCorpus
+from .model import check_vocabulary, fit_vectorizer, load_manifest, load_model, save_model
+from .models import Album, Artist, Playlist, Song, SongLyrics, TasteProfile, UserRecommendation, lyrics_digest
+from .preprocessing import preprocess_lyrics, preprocess_many, tokenize
+from .recommendations import (SONG_CACHE_ALIAS, SongRecommendationCache, compute_recommendations, song_recommendations,
+                              user_recommendations)
+
+
+def nltk_data_available(*resources):
+    for resource in resources:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            return False
+    return True
+
+
+legacy_stemmer = PorterStemmer()
+
+
+def legacy_preprocess_lyrics(lyrics):
+    # The original NLTK-based implementation, kept as the parity reference
+    if not isinstance(lyrics, str):
+        return ''
+    lyrics = re.sub(r'[^a-zA-Z\s]', '', lyrics).lower()
+    tokens = word_tokenize(lyrics)
+    stop_words = set(stopwords.words('english'))
+    tokens = [word for word in tokens if word not in stop_words]
+    return ' '.join(legacy_stemmer.stem(word) for word in tokens)
+
+
+SAMPLE_LYRICS = [
+    "I'm gonna tell you, I cannot wait\nGimme the night, lemme go, we gotta run\nWanna dance? wanna",
+    "Started from the bottom now we here (here!)\n2x Started from the bottom, now my whole team f***in' here",
+    "  Tabs\tand odd   spacing\r\nCAPITALS, Numbers 1234 and punctuation... ",
+    "",
+    None,
+]
+
+
+def corpus_lyrics():
+    path = os.path.join(settings.BASE_DIR, 'music', 'models', 'all_cleaned_lyrics.json')
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class TokenizeTests(SimpleTestCase):
+    def test_matches_nltk_word_tokenizer_on_cleaned_text(self):
+        nltk_tokenizer = NLTKWordTokenizer()
+        for lyrics in SAMPLE_LYRICS[:-1] + corpus_lyrics():
+            cleaned = re.sub(r'[^a-zA-Z\s]', '', lyrics).lower()
+            self.assertEqual(tokenize(cleaned), nltk_tokenizer.tokenize(cleaned))
+
+
+@unittest.skipUnless(nltk_data_available('tokenizers/punkt_tab', 'corpora/stopwords'), "NLTK data not downloaded")
+class PreprocessParityTests(SimpleTestCase):
+    def test_matches_legacy_preprocessing(self):
+        for lyrics in SAMPLE_LYRICS + corpus_lyrics():
+            self.assertEqual(preprocess_lyrics(lyrics), legacy_preprocess_lyrics(lyrics))
+
+    def test_preprocess_many_keeps_order(self):
+        lyrics_list = SAMPLE_LYRICS + corpus_lyrics()
+        expected = [preprocess_lyrics(lyrics) for lyrics in lyrics_list]
+        self.assertEqual(preprocess_many(lyrics_list), expected)
+        self.assertEqual(preprocess_many(lyrics_list, processes=2, chunksize=16), expected)
+
+
+class StreamingCorpusTests(SimpleTestCase):
+    def setUp(self):
+        self.documents = corpus_lyrics()
+        self.vectorizer, self.X = fit_vectorizer()
+
+    def assertMatchesVectorizer(self, corpus):
+        self.assertEqual(corpus.vocabulary, self.vectorizer.get_feature_names_out().tolist())
+        self.assertEqual((corpus.matrix() != self.X).nnz, 0)
+
+    def test_matches_count_vectorizer(self):
+        corpus = StreamingCorpus()
+        self.assertTrue(corpus.add(self.documents))
+        self.assertMatchesVectorizer(corpus)
+
+    def test_incremental_adds_match_refit(self):
+        corpus = StreamingCorpus()
+        for start in range(0, len(self.documents), 7):
+            corpus.add(self.documents[start:start + 7])
+        self.assertMatchesVectorizer(corpus)
+
+    def test_vocabulary_only_changes_when_a_cutoff_is_crossed(self):
+        corpus = StreamingCorpus()
+        corpus.add(self.documents)
+        vocabulary = corpus.vocabulary
+        self.assertFalse(corpus.add(['zzyzx']))
+        self.assertTrue(corpus.add(['zzyzx']))
+        self.assertEqual(sorted(vocabulary + ['zzyzx']), corpus.vocabulary)
+
+    def test_unseen_vocabulary_terms_get_empty_columns(self):
+        corpus = StreamingCorpus()
+        corpus.add(['garden garden rain'])
+        X = corpus.matrix(['garden', 'zzyzx', 'rain'])
+        self.assertEqual(X.toarray().tolist(), [[2, 0, 1]])
+
+    def test_save_and_load(self):
+        corpus = StreamingCorpus()
+        corpus.add(self.documents, [str(row) for row in range(len(self.documents))])
+        with tempfile.TemporaryDirectory() as directory:
+            corpus.save(os.path.join(directory, 'corpus.npz'))
+            loaded = StreamingCorpus.load(os.path.join(directory, 'corpus.npz'))
+        self.assertEqual(loaded.keys, corpus.keys)
+        self.assertMatchesVectorizer(loaded)
+
+
+class ModelStorageTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vocabulary = np.array(['garden', 'rain', 'road', 'summer', 'train'])
+        self.model = (rng.dirichlet(np.ones(3), size=4), rng.dirichlet(np.ones(5), size=3).T, np.full(3, 1 / 3))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'plsa')
+
+    def test_float32_round_trip(self):
+        save_model(self.model, self.vocabulary, self.path)
+        loaded = load_model(self.path)
+        for P, P_loaded in zip(self.model, loaded):
+            self.assertIsInstance(P_loaded, np.memmap)
+            self.assertEqual(P_loaded.dtype, np.float32)
+            np.testing.assert_array_equal(P_loaded, P.astype(np.float32))
+
+    def test_quantized_round_trip(self):
+        manifest = save_model(self.model, self.vocabulary, self.path, quantize=True)
+        self.assertEqual(manifest['arrays']['P_w_z_quantized']['dtype'], 'uint8')
+        P_d_z, P_w_z, P_z = load_model(self.path)
+        self.assertEqual(P_w_z.dtype, np.float32)
+        scale = np.load(os.path.join(self.path, 'P_w_z_scale.npy'))
+        self.assertTrue((np.abs(P_w_z - self.model[1]) <= scale / 2 + 1e-7).all())
+        np.testing.assert_array_equal(P_d_z, self.model[0].astype(np.float32))
+
+    def test_vocabulary_hash(self):
+        save_model(self.model, self.vocabulary, self.path, quantize=True)
+        manifest = load_manifest(self.path)
+        check_vocabulary(manifest, self.vocabulary)
+        with self.assertRaises(ValueError):
+            check_vocabulary(manifest, self.vocabulary[::-1])
+
+
+class ReleaseTests(SimpleTestCase):
+    def test_catalog_vectors_must_match_the_model(self):
+        plsa = (np.ones((3, 5)), np.ones((7, 5)), np.ones(5))
+        corpus = (np.array(['garden']), np.ones((2, 5)), (np.array(['A', 'B']),) * 2 + (np.arange(2),))
+        catalog = (np.ones((2, 10), dtype=np.float32), corpus[2])
+        with mock.patch('music.model.load_model', return_value=plsa), \
+                mock.patch('music.model.fit_corpus', return_value=corpus), \
+                mock.patch('music.model.catalog_corpus', return_value=catalog), \
+                mock.patch('music.model._replace_dir') as replace_dir:
+            with self.assertRaisesRegex(ValueError, 'backfill_topic_vectors'):
+                model.build_artifacts()
+        replace_dir.assert_not_called()
+
+    def test_prune_keeps_the_newest_builds(self):
+        releases = ['v5-20260101000000000000', 'v5-20260301000000000000', 'v10-20260401000000000000',
+                    'v10-20260501000000000000']
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('music.model.model_path', lambda filename: os.path.join(directory, filename)):
+            for release in releases:
+                os.makedirs(model.release_path(release))
+            model.publish_release(releases[0])
+            model.prune_releases(2)
+            self.assertEqual(sorted(os.listdir(os.path.join(directory, model.RELEASES_DIR))),
+                             sorted([model.CURRENT_POINTER, releases[0]] + releases[2:]))
+
+    def test_bad_release_is_tried_once(self):
+        engine = mock.Mock(release='v5-old')
+        with mock.patch.object(model, '_engine', engine), \
+                mock.patch.object(model, '_pointer_mtime', 1), \
+                mock.patch('music.model.release_pointer_mtime', return_value=2), \
+                mock.patch('music.model.current_release', return_value='v5-bad'), \
+                mock.patch('music.model.RecommenderEngine', side_effect=ValueError("bad release")) as build, \
+                mock.patch('builtins.print'):
+            model.reload_engine()
+            model.reload_engine()
+            self.assertIs(model._engine, engine)
+        build.assert_called_once_with('v5-bad')
+
+
+# pLSA
+def synthetic_counts(n_docs, n_words, seed=0):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, 4, size=(n_docs, n_words)) * (rng.random((n_docs, n_words)) < 0.4)
+    return sparse.csr_matrix(counts, dtype=np.float64)
+
+
+class PLSATrainingTests(SimpleTestCase):
+    def test_e_step_matches_dense_reference(self):
+        rng = np.random.default_rng(1)
+        X = synthetic_counts(6, 9)
+        D = rng.random((6, 3))
+        P_w_z = rng.dirichlet(np.ones(9), size=3).T
+        word_counts, doc_counts, log_likelihood = plsa.e_step(X, D, P_w_z)
+
+        # The full documents x words x topics posterior
+        joint = D[:, None, :] * P_w_z[None, :, :]
+        P_dw = joint.sum(axis=2)
+        weighted = X.toarray()[:, :, None] * joint / P_dw[:, :, None]
+        np.testing.assert_allclose(word_counts, weighted.sum(axis=0))
+        np.testing.assert_allclose(doc_counts, weighted.sum(axis=1))
+        self.assertAlmostEqual(log_likelihood, float((X.toarray() * np.log(P_dw)).sum()))
+
+    def test_processes_match_serial(self):
+        X = synthetic_counts(40, 30)
+        serial, serial_log_likelihood = plsa.train(X, 4, max_iter=5, tol=0, processes=1, log=lambda message: None)
+        pooled, pooled_log_likelihood = plsa.train(X, 4, max_iter=5, tol=0, processes=2, log=lambda message: None)
+        for P, P_pooled in zip(serial, pooled):
+            np.testing.assert_allclose(P, P_pooled)
+        self.assertAlmostEqual(serial_log_likelihood, pooled_log_likelihood)
+
+    def test_warm_start_shapes(self):
+        X = synthetic_counts(20, 15)
+        (P_d_z, P_w_z, P_z), _ = plsa.train(X, 3, max_iter=3, log=lambda message: None)
+        # Other documents, same vocabulary: P(d|z) is folded in from X
+        other = synthetic_counts(12, 15, seed=1)
+        (P_d_z_warm, P_w_z_warm, P_z_warm), _ = plsa.train(other, 3, max_iter=3, warm_start=(P_d_z, P_w_z, P_z),
+                                                           log=lambda message: None)
+        self.assertEqual((P_d_z_warm.shape, P_w_z_warm.shape, P_z_warm.shape), ((12, 3), (15, 3), (3,)))
+        np.testing.assert_allclose(plsa.initial_model(other, 3, (P_d_z, P_w_z, P_z))[0].sum(axis=0), 1)
+        with self.assertRaises(ValueError):
+            plsa.initial_model(synthetic_counts(12, 16), 3, (P_d_z, P_w_z, P_z))
+        with self.assertRaises(ValueError):
+            plsa.initial_model(X, 4, (P_d_z, P_w_z, P_z))
+
+
+class FoldInTests(SimpleTestCase):
+    def setUp(self):
+        counts = synthetic_counts(8, 12).toarray()
+        counts[3] = 0  # A document without known words
+        self.X = sparse.csr_matrix(counts)
+        self.P_w_z = np.random.default_rng(2).dirichlet(np.ones(12), size=4).T
+
+    def test_rows_are_distributions(self):
+        P_z_d = plsa.fold_in(self.X, self.P_w_z)
+        empty = self.X.getnnz(axis=1) == 0
+        self.assertTrue(empty[3])
+        np.testing.assert_allclose(P_z_d[~empty].sum(axis=1), 1)
+        np.testing.assert_array_equal(P_z_d[empty], 0)
+
+    def test_iteration_cap_and_early_stop(self):
+        with mock.patch('music.plsa.pair_probabilities', wraps=plsa.pair_probabilities) as iterations:
+            plsa.fold_in(self.X, self.P_w_z, max_iter=7, tol=-1)  # Never converges
+            self.assertEqual(iterations.call_count, 7)
+            iterations.reset_mock()
+            plsa.fold_in(self.X, self.P_w_z, max_iter=50, tol=1)  # Converged after one
+            self.assertEqual(iterations.call_count, 1)
+            iterations.reset_mock()
+            plsa.fold_in(self.X, self.P_w_z, max_iter=500, tol=1e-3)
+            self.assertGreater(iterations.call_count, 1)
+            self.assertLess(iterations.call_count, 500)
+
+    def test_batch_matches_single_documents(self):
+        batch = plsa.fold_in(self.X, self.P_w_z, max_iter=10, tol=0)
+        for row in range(self.X.shape[0]):
+            np.testing.assert_allclose(batch[row], plsa.fold_in(self.X[row], self.P_w_z, max_iter=10, tol=0)[0])
+
+    @override_settings(RECOMMENDER_FOLD_IN_ITERATIONS=10, RECOMMENDER_FOLD_IN_TOL=0)
+    def test_engine_inference(self):
+        engine = synthetic_engine(np.full((2, 4), 1 / 4), ['Pop', 'Rock'])
+        vocabulary = [f'word{column:02d}' for column in range(12)]
+        engine.vectorizer = CountVectorizer(vocabulary=vocabulary)
+        engine.P_w_z, engine.inference = self.P_w_z, 'projection'
+        documents = [' '.join(word for word, count in zip(vocabulary, row) for _ in range(int(count)))
+                     for row in self.X.toarray()]
+        np.testing.assert_allclose(engine.topic_distributions(documents, inference='fold_in'),
+                                   plsa.fold_in(self.X, self.P_w_z, max_iter=10, tol=0))
+        np.testing.assert_allclose(engine.topic_distributions(documents), model.project_topics(self.X, self.P_w_z))
+
+
+# Ranked indexes
+def synthetic_engine(P_z_corpus, genres, topic_index=None, genre_index=None, ann_index=None):
+    # The engine's ranking state without a model or a release behind it
+    engine = model.RecommenderEngine.__new__(model.RecommenderEngine)
+    engine.P_z_corpus = P_z_corpus
+    engine.song_titles = np.array([f'Song {row}' for row in range(len(P_z_corpus))])
+    engine.song_genres = np.asarray(genres)
+    engine.song_ids = np.arange(len(P_z_corpus))
+    engine.song_ids_stale = False
+    engine.genre_names, engine.genre_codes = np.unique(engine.song_genres, return_inverse=True)
+    engine.topic_index, engine.genre_index, engine.ann_index = topic_index, genre_index, ann_index
+    engine.metric = ann_index.metric if ann_index is not None else 'hellinger'
+    engine.X_corpus = model.load_search_matrix(None, P_z_corpus, engine.metric)
+    return engine
+
+
+class RankedIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.P_z_corpus = rng.dirichlet(np.ones(6), size=200).astype(np.float32)
+        self.genres = rng.choice(['Country', 'HipHop', 'Pop', 'Rock'], size=200)
+
+    def test_topic_index_matches_fallback(self):
+        indexed = synthetic_engine(self.P_z_corpus, self.genres, topic_index=model.build_topic_index(self.P_z_corpus))
+        fallback = synthetic_engine(self.P_z_corpus, self.genres)
+        for topic_index in range(6):
+            expected = np.argsort(-self.P_z_corpus[:, topic_index], kind='stable')[:20]
+            for engine in (indexed, fallback):
+                rows, scores = engine.top_rows(topic_index, 20)
+                np.testing.assert_array_equal(rows, expected)
+                np.testing.assert_array_equal(scores, self.P_z_corpus[expected, topic_index])
+
+    def test_stale_topic_index_is_rejected(self):
+        topic_rank, topic_rank_scores = model.build_topic_index(self.P_z_corpus[:150])
+        with tempfile.TemporaryDirectory() as directory:
+            np.save(os.path.join(directory, 'topic_rank.npy'), topic_rank)
+            np.save(os.path.join(directory, 'topic_rank_scores.npy'), topic_rank_scores)
+            self.assertIsNotNone(model.load_topic_index(directory, self.P_z_corpus[:150]))
+            self.assertIsNone(model.load_topic_index(directory, self.P_z_corpus))
+            self.assertIsNone(model.load_topic_index(directory, self.P_z_corpus[:150, :5]))
+        self.assertIsNone(model.load_topic_index(directory, self.P_z_corpus[:150]))
+
+    def test_exact_search_ranks_by_hellinger(self):
+        engine = synthetic_engine(self.P_z_corpus, self.genres)
+        profile = self.P_z_corpus[:3].sum(axis=0) * 4  # Unnormalized, like a taste profile
+        similarity = np.sqrt(self.P_z_corpus) @ np.sqrt(profile / profile.sum())
+        for genres in (None, ['Pop', 'Rock']):
+            rows = np.arange(200) if genres is None else np.flatnonzero(np.isin(self.genres, genres))
+            expected = rows[np.argsort(-similarity[rows], kind='stable')[:10]]
+            found, scores = engine.exact_rows(profile, 10, genres)
+            np.testing.assert_array_equal(found, expected)
+            np.testing.assert_allclose(scores, similarity[expected], rtol=1e-5)
+
+    def test_genre_index_merge_matches_brute_force(self):
+        genre_names, genre_offsets, genre_rank, genre_rank_scores = model.build_genre_index(self.P_z_corpus, self.genres)
+        indexed = synthetic_engine(self.P_z_corpus, self.genres,
+                                   genre_index=(genre_names, genre_offsets, genre_rank, genre_rank_scores))
+        fallback = synthetic_engine(self.P_z_corpus, self.genres)
+        for genres in (['Pop'], ['Country', 'Rock'], ['HipHop', 'Pop', 'Rock', 'Unknown']):
+            genre_rows = np.flatnonzero(np.isin(self.genres, genres))
+            for topic_index in range(6):
+                expected = genre_rows[np.argsort(-self.P_z_corpus[genre_rows, topic_index], kind='stable')[:15]]
+                for engine in (indexed, fallback):
+                    rows, scores = engine.top_rows_in_genres(topic_index, genres, 15)
+                    np.testing.assert_array_equal(rows, expected)
+                    np.testing.assert_array_equal(scores, self.P_z_corpus[expected, topic_index])
+
+
+class IVFIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.dirichlet(np.full(10, 0.3), size=5000).astype(np.float32)
+        self.queries = rng.dirichlet(np.full(10, 0.3), size=100)
+        self.index = IVFIndex().build(self.vectors)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_loaded_index_matches_built_one(self):
+        self.index.save(os.path.join(self.directory, 'ann'), build_id='build')
+        loaded = IVFIndex.load(os.path.join(self.directory, 'ann'))
+        for query in self.queries[:20]:
+            for built, found in zip(self.index.search(query, 10), loaded.search(query, 10)):
+                np.testing.assert_array_equal(built, found)
+
+    def test_recall_at_default_n_probe(self):
+        X = transform(self.vectors)
+        recall = np.mean([
+            len(set(self.index.search(query, 10)[0]) & set(exact_search(X, transform(query)[0], 10)[0])) / 10
+            for query in self.queries
+        ])
+        self.assertGreaterEqual(recall, 0.95)
+
+    def test_index_of_another_build_is_rejected(self):
+        self.index.save(os.path.join(self.directory, 'ann'), build_id='build')
+        self.assertIsNotNone(model.load_ann_index(self.directory, 'build'))
+        self.assertIsNone(model.load_ann_index(self.directory, 'other-build'))
+        self.assertIsNone(model.load_ann_index(self.directory, None))
+
+
+# Query budgets
+# Seeded catalog: 50 artists x 4 albums x 15 songs = 3000 songs
+SEED_ARTISTS, SEED_ALBUMS_PER_ARTIST, SEED_SONGS_PER_ALBUM = 50, 4, 15
+SEED_GENRES = ['Pop', 'Rock', 'Hip-Hop', 'Jazz', 'Country', 'Electronic']
+
+# Recommendations are read as computed for this version, the recommender itself is not loaded
+TEST_MODEL_VERSION = 'query-budget'
+
+# URL names without a budget, and why
+BUDGET_EXEMPT = {
+    'predict_song_topic': "routes straight to model.predict_song_topic, which is not a view",
+}
+
+
+def seed_catalog():
+    artists = Artist.objects.bulk_create(Artist(name=f'Artist {i}') for i in range(SEED_ARTISTS))
+    albums = Album.objects.bulk_create(
+        Album(album_title=f'Album {artist.id}-{i}', artist=artist, genre=SEED_GENRES[(artist.id + i) % len(SEED_GENRES)])
+        for artist in artists for i in range(SEED_ALBUMS_PER_ARTIST))
+    # bulk_create skips Song.save(), so no topic vectors are computed
+    return Song.objects.bulk_create(
+        Song(song_title=f'Song {album.id}-{i}', artist_id=album.artist_id, album=album, genre=album.genre)
+        for album in albums for i in range(SEED_SONGS_PER_ALBUM))
+
+
+def link_songs(playlist, songs):
+    # Through the table directly: no m2m_changed, so no recommendations are recomputed while seeding
+    Playlist.songs.through.objects.bulk_create(Playlist.songs.through(playlist=playlist, song=song) for song in songs)
+
+
+@mock.patch('music.recommendations.model_version', return_value=TEST_MODEL_VERSION)
+class QueryBudgetTests(TestCase):
+    """
+    The most queries each page in music/urls.py may run against a seeded catalog
+    of a few thousand songs. A page going over (typically a new N+1) fails with
+    the queries it ran; lower a budget when a page gets cheaper.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.songs = seed_catalog()
+        cls.album = cls.songs[0].album
+        search.rebuild_index()
+        User = get_user_model()
+        cls.user = User.objects.create_user('listener', 'listener-password')
+        cls.staff = User.objects.create_superuser('staff', 'staff-password')
+
+        # create_user made the Favorites playlist
+        cls.favorites = Playlist.objects.get(user=cls.user, name="Favorites")
+        link_songs(cls.favorites, cls.songs[:30])
+        cls.playlist = Playlist.objects.create(user=cls.user, name="Road trip")
+        link_songs(cls.playlist, cls.songs[::30])
+        for i in range(3):
+            Playlist.objects.create(user=cls.user, name=f"Playlist {i}")
+        TasteProfile.objects.create(user=cls.user, genre_counts={cls.album.genre: 30})
+        UserRecommendation.objects.bulk_create(
+            UserRecommendation(user=cls.user, song=song, score=1 / rank, rank=rank, model_version=TEST_MODEL_VERSION)
+            for rank, song in enumerate(cls.songs[100:120], start=1))
+
+    def setUp(self):
+        # Budgets are for a cold catalog cache
+        caches['default'].clear()
+        self.user_client = Client()
+        self.user_client.force_login(self.user)
+
+    def assertQueryBudget(self, budget, url, client=None, method='get', data=None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, data or {})
+        self.assertLess(response.status_code, 400, f"{method.upper()} {url}")
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{method.upper()} {url} ran {len(queries)} queries, over its budget of {budget}:\n"
+            + "\n".join(query['sql'] for query in queries.captured_queries))
+        return response
+
+    def test_every_url_has_a_budget(self, model_version):
+        names = {pattern.name for pattern in urls.urlpatterns} - set(BUDGET_EXEMPT)
+        tested = {name[len('test_'):] for name in dir(self) if name.startswith('test_')}
+        self.assertEqual(names - tested, set(), "Add a test_<url name> query budget for these URLs")
+
+    def test_index(self, model_version):
+        # Session, user, playlists, recommendations, albums
+        self.assertQueryBudget(5, reverse('index'), self.user_client)
+        # Albums now cached
+        self.assertQueryBudget(4, reverse('index'), self.user_client)
+        caches['default'].clear()
+        self.assertQueryBudget(1, reverse('index'))
+
+    def test_album_detail(self, model_version):
+        self.assertQueryBudget(2, reverse('album_detail', args=[self.album.id]))
+        self.assertQueryBudget(6, reverse('album_detail', args=[self.album.id]), self.user_client)
+
+    def test_search(self, model_version):
+        # Search index, then the matched songs with artist and album
+        self.assertQueryBudget(2, reverse('search') + '?q=song 1')
+        self.assertQueryBudget(5, reverse('search') + '?q=artist 4&lyrics=1', self.user_client)
+
+    def test_search_songs(self, model_version):
+        response = self.assertQueryBudget(2, reverse('search_songs') + '?q=album&limit=100')
+        self.assertEqual(len(response.json()['results']), search.SEARCH_MAX_LIMIT)
+
+    def test_song_lyrics(self, model_version):
+        # Song, and its neighbours once build_song_neighbours has run
+        self.assertQueryBudget(2, reverse('song_lyrics', args=[self.songs[0].id]))
+
+    def test_create_playlist(self, model_version):
+        # The catalog is searched from the page, not rendered into it
+        response = self.assertQueryBudget(3, reverse('create_playlist'), self.user_client)
+        self.assertNotContains(response, self.songs[-1].song_title)
+        song_ids = [song.id for song in self.songs[:50]]
+        self.assertQueryBudget(9, reverse('create_playlist'), self.user_client, 'post',
+                               {'name': 'New playlist', 'songs': song_ids})
+
+    def test_playlist_detail(self, model_version):
+        self.assertQueryBudget(5, reverse('playlist_detail', args=[self.playlist.id]), self.user_client)
+
+    def test_remove_from_playlist(self, model_version):
+        url = reverse('remove_from_playlist', args=[self.playlist.id, self.songs[0].id])
+        self.assertQueryBudget(6, url, self.user_client, 'post')
+
+    def test_delete_playlist(self, model_version):
+        self.assertQueryBudget(5, reverse('delete_playlist', args=[self.playlist.id]), self.user_client, 'post')
+
+    def test_add_to_favorites(self, model_version):
+        # Includes updating the taste profile and refreshing the recommendations
+        self.assertQueryBudget(18, reverse('add_to_favorites', args=[self.songs[500].id]), self.user_client, 'post')
+
+    def test_favorites_playlist(self, model_version):
+        self.assertQueryBudget(4, reverse('favorites_playlist'), self.user_client)
+
+    def test_remove_from_favorites(self, model_version):
+        self.assertQueryBudget(18, reverse('remove_from_favorites', args=[self.songs[0].id]), self.user_client, 'post')
+
+    def test_login(self, model_version):
+        self.assertQueryBudget(0, reverse('login'))
+        self.assertQueryBudget(9, reverse('login'), method='post',
+                               data={'username': 'listener', 'password': 'listener-password'})
+
+    def test_logout(self, model_version):
+        self.assertQueryBudget(4, reverse('logout'), self.user_client, 'post')
+
+    def test_signup(self, model_version):
+        self.assertQueryBudget(0, reverse('signup'))
+
+    def test_query_stats(self, model_version):
+        staff_client = Client()
+        staff_client.force_login(self.staff)
+        with override_settings(QUERY_INSTRUMENTATION=True):
+            self.assertQueryBudget(3, reverse('query_stats'), staff_client)
+
+
+@mock.patch('music.recommendations.model_version', return_value=TEST_MODEL_VERSION)
+class UserRecommendationsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.songs = seed_catalog()[:3]
+        cls.user = get_user_model().objects.create_user('listener', 'listener-password')
+        # Songs without lyrics or topic vectors: nothing to recommend from
+        link_songs(Playlist.objects.get(user=cls.user, name="Favorites"), cls.songs)
+
+    def setUp(self):
+        caches[SONG_CACHE_ALIAS].clear()
+
+    @mock.patch('music.recommendations.compute_recommendations', wraps=compute_recommendations)
+    def test_empty_result_is_not_recomputed(self, compute, model_version):
+        self.assertEqual(user_recommendations(self.user), [])
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(TasteProfile.objects.get(user=self.user).recommendations_version, TEST_MODEL_VERSION)
+
+        # The rows and the profile's marker, nothing else
+        with self.assertNumQueries(2):
+            self.assertEqual(user_recommendations(self.user), [])
+        self.assertEqual(compute.call_count, 1)
+
+        model_version.return_value = 'next-model'
+        self.assertEqual(user_recommendations(self.user), [])
+        self.assertEqual(compute.call_count, 2)
+        self.assertEqual(TasteProfile.objects.get(user=self.user).recommendations_version, 'next-model')
+
+
+@mock.patch('music.signals.refresh_user_recommendations')
+class TasteProfileTests(TestCase):
+    VECTORS = np.array([[0.7, 0.2, 0.1], [0.1, 0.8, 0.1], [0.2, 0.2, 0.6], [0.3, 0.3, 0.4]], dtype=np.float32)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.songs = seed_catalog()[:len(cls.VECTORS)]
+        for song, P_z in zip(cls.songs, cls.VECTORS):
+            song.set_topic_distribution(P_z)
+        Song.objects.bulk_update(cls.songs, Song.TOPIC_FIELDS)
+        cls.user = get_user_model().objects.create_user('listener', 'listener-password')
+        cls.favorites = Playlist.objects.get(user=cls.user, name="Favorites")
+        cls.playlist = Playlist.objects.create(user=cls.user, name="Road trip")
+
+    def assertProfile(self, vectors):
+        profile = TasteProfile.objects.get(user=self.user)
+        if not len(vectors):
+            self.assertEqual((profile.vector, profile.song_count, profile.genre_counts), (None, 0, {}))
+            return
+        np.testing.assert_allclose(profile.vector, np.sum(vectors, axis=0), rtol=1e-6)
+        self.assertEqual(profile.song_count, len(vectors))
+        self.assertEqual(profile.genre_counts, {self.songs[0].genre: len(vectors)})
+
+    def test_like_and_unlike(self, refresh):
+        self.favorites.songs.add(self.songs[0], self.songs[1])
+        self.assertProfile(self.VECTORS[[0, 1]])
+        self.favorites.songs.add(self.songs[2])
+        self.assertProfile(self.VECTORS[[0, 1, 2]])
+        self.favorites.songs.remove(self.songs[0], self.songs[3])  # The second was never liked
+        self.assertProfile(self.VECTORS[[1, 2]])
+        self.playlist.songs.add(self.songs[3])
+        self.assertProfile(self.VECTORS[[1, 2]])
+        self.assertEqual(refresh.call_count, 3)
+
+    def test_clear(self, refresh):
+        self.favorites.songs.add(*self.songs[:3])
+        self.favorites.songs.clear()
+        self.assertProfile([])
+
+    def test_reverse_add_and_remove(self, refresh):
+        self.favorites.songs.add(self.songs[0])
+        self.songs[1].playlists.add(self.favorites, self.playlist)
+        self.assertProfile(self.VECTORS[[0, 1]])
+        self.songs[1].playlists.remove(self.playlist)
+        self.assertProfile(self.VECTORS[[0, 1]])
+        self.songs[0].playlists.clear()
+        self.assertProfile(self.VECTORS[[1]])
+
+    def test_rebuilt_when_a_favorites_vector_changes(self, refresh):
+        self.favorites.songs.add(self.songs[0], self.songs[1])
+        refresh.reset_mock()
+
+        def update_topic_vector(song):
+            song.set_topic_distribution(self.VECTORS[3])
+            return True
+
+        song = Song.objects.get(id=self.songs[0].id)
+        song.lyrics = "new lyrics"
+        with mock.patch.object(Song, 'update_topic_vector', autospec=True, side_effect=update_topic_vector):
+            song.save()
+        self.assertProfile(self.VECTORS[[3, 1]])
+        refresh.assert_called_once_with(self.user)
+
+    @mock.patch('music.recommendations.compute_recommendations', return_value=[])
+    @mock.patch('music.recommendations.model_version', return_value=TEST_MODEL_VERSION)
+    def test_rebuilt_on_model_version_change(self, model_version, compute, refresh):
+        self.favorites.songs.add(self.songs[0], self.songs[1])
+        # Song vectors recomputed by a new model (backfill_topic_vectors bypasses signals)
+        Song.objects.filter(id=self.songs[0].id).update(topic_vector=self.VECTORS[2].tobytes())
+        UserRecommendation.objects.create(user=self.user, song=self.songs[3], score=1, rank=1,
+                                          model_version='previous-model')
+        user_recommendations(self.user)
+        self.assertProfile(self.VECTORS[[2, 1]])
+        self.assertEqual(TasteProfile.objects.get(user=self.user).recommendations_version, TEST_MODEL_VERSION)
+
+
+class NeighboursTests(TestCase):
+    K = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.songs = seed_catalog()[:60]
+        cls.rng = np.random.default_rng(0)
+        cls.set_vectors(cls.songs[:40])
+
+    @classmethod
+    def set_vectors(cls, songs):
+        # Peaked distributions, so similarities spread out and rankings have no near ties
+        for song in songs:
+            song.set_topic_distribution(cls.rng.dirichlet(np.full(10, 0.3)))
+        Song.objects.bulk_update(songs, Song.TOPIC_FIELDS)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch('music.neighbours.artifact_path', lambda name: os.path.join(directory.name, name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, neighbours, '_neighbours', None)
+
+    def build(self, changed_only):
+        neighbours._neighbours = None
+        recomputed, total = neighbours.build_neighbours(self.K, changed_only)
+        neighbours._neighbours = None
+        return recomputed, np.array(neighbours.load_neighbours())
+
+    def test_incremental_build_matches_full_rebuild(self):
+        self.build(changed_only=False)
+        self.set_vectors(self.songs[:3])  # Edited
+        self.set_vectors(self.songs[40:42])  # Added
+        Song.objects.filter(id__in=[song.id for song in self.songs[10:12]]).delete()
+
+        recomputed, incremental = self.build(changed_only=True)
+        self.assertLess(recomputed, 38)
+        recomputed, full = self.build(changed_only=False)
+        self.assertEqual(recomputed, 40)
+
+        np.testing.assert_array_equal(incremental['ids'], full['ids'])
+        np.testing.assert_allclose(incremental['scores'], full['scores'], atol=1e-3)
+        np.testing.assert_array_equal(incremental['digest'], full['digest'])
+        self.assertFalse(np.isin([song.id for song in self.songs[10:12]], incremental['ids']).any())
+
+
+class QueryInstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.album = seed_catalog()[0].album
+
+    def setUp(self):
+        caches['default'].clear()
+        middleware.query_stats.clear()
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_headers_and_stats(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = Client().get(reverse('album_detail', args=[self.album.id]))
+        self.assertEqual(response['X-Query-Count'], str(len(queries)))
+        self.assertGreater(float(response['X-Query-Time-Ms']), 0)
+        self.assertEqual(response['X-Query-Duplicates'], '')
+        self.assertEqual(middleware.query_stats['album_detail']['requests'], 1)
+
+    def test_off_unless_enabled(self):
+        with override_settings(QUERY_INSTRUMENTATION=False):
+            response = Client().get(reverse('album_detail', args=[self.album.id]))
+        self.assertNotIn('X-Query-Count', response)
+        self.assertEqual(middleware.query_stats, {})
+
+    def test_repeated_queries_are_reported(self):
+        recorder = middleware.QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for song in Song.objects.filter(album=self.album):
+                song.artist.name
+            list(Song.objects.filter(id__in=[1, 2, 3]))
+            list(Song.objects.filter(id__in=[4, 5]))
+        counts = sorted(count for count, sql in recorder.duplicates().values())
+        # One artist lookup per song, and the two IN queries as one shape
+        self.assertEqual(counts, [2, SEED_SONGS_PER_ALBUM])
+
+
+# Song topic vectors
+@mock.patch('builtins.print')
+class SongTopicVectorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='Artist')
+
+    def assertSavedWithoutVector(self):
+        song = Song.objects.create(song_title='Song', artist=self.artist, lyrics='hello world love')
+        song = Song.objects.get(id=song.id)
+        self.assertEqual(song.lyrics, 'hello world love')
+        self.assertIsNone(song.topic_vector)
+        self.assertEqual(song.lyrics_hash, '')
+
+    def test_saved_when_the_model_is_unavailable(self, print):
+        with mock.patch('music.model.get_engine', side_effect=FileNotFoundError("no model")):
+            self.assertSavedWithoutVector()
+
+    def test_saved_when_preprocessing_fails(self, print):
+        engine = synthetic_engine(np.full((2, 3), 1 / 3), ['Pop', 'Rock'])
+        with mock.patch('music.model.get_engine', return_value=engine), \
+                mock.patch('music.model.preprocess_many', side_effect=LookupError("stopwords not found")):
+            self.assertSavedWithoutVector()
+
+
+# Related songs cache
+@mock.patch('music.recommendations.model_version', return_value=TEST_MODEL_VERSION)
+@mock.patch('music.recommendations.predict_song_topics')
+class SongRecommendationCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches[SONG_CACHE_ALIAS].clear()
+        self.songs = [Song(id=i, song_title=f'Song {i}', lyrics=f'garden {i}') for i in range(1, 4)]
+
+    def test_stats_are_kept_in_the_cache(self, predict_song_topics, model_version):
+        predict_song_topics.side_effect = lambda lyrics_list, top_n, by_genre: [(0, 1.0, {}) for _ in lyrics_list]
+        SongRecommendationCache().related_songs(self.songs[:2])
+        # Another instance (another worker, with a shared backend) sees the same counters
+        SongRecommendationCache().related_songs(self.songs)
+        self.assertEqual(song_recommendations.stats(), {'hits': 2, 'misses': 3, 'hit_rate': 0.4})
+        self.assertEqual(predict_song_topics.call_count, 2)
+
+    def test_edited_lyrics_miss_even_with_a_stale_hash(self, predict_song_topics, model_version):
+        predict_song_topics.side_effect = lambda lyrics_list, top_n, by_genre: [(0, 1.0, {}) for _ in lyrics_list]
+        song = self.songs[0]
+        song.lyrics_hash = lyrics_digest(song.lyrics)
+        SongRecommendationCache().related_songs([song])
+        # Edited while the topic vector could not be recomputed, so lyrics_hash was not updated
+        song.lyrics = 'rain on the road'
+        SongRecommendationCache().related_songs([song])
+        self.assertEqual(predict_song_topics.call_count, 2)
+
+
+# Song lyrics
+@mock.patch.object(Song, 'update_topic_vector', return_value=False)
+class SongLyricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='Artist')
+        cls.lyrics = corpus_lyrics()[0]
+
+    def test_stored_apart_and_loaded_on_demand(self, update_topic_vector):
+        song = Song.objects.create(song_title='Song', artist=self.artist, lyrics=self.lyrics)
+        self.assertTrue(SongLyrics.objects.get(song=song).compressed)
+
+        with CaptureQueriesContext(connection) as queries:
+            song = Song.objects.get(id=song.id)
+        self.assertNotIn('songlyrics', queries.captured_queries[0]['sql'].lower())
+        with self.assertNumQueries(1):
+            self.assertEqual(song.lyrics, self.lyrics)
+            self.assertEqual(song.lyrics, self.lyrics)
+        with self.assertNumQueries(1):
+            self.assertEqual(Song.objects.select_related('lyrics_storage').get(id=song.id).lyrics, self.lyrics)
+
+    def test_update_and_clear(self, update_topic_vector):
+        song = Song.objects.create(song_title='Song', artist=self.artist, lyrics=self.lyrics)
+        song = Song.objects.get(id=song.id)
+        song.genre = 'Pop'
+        song.save(update_fields=['genre'])
+        self.assertEqual(Song.objects.get(id=song.id).lyrics, self.lyrics)
+
+        song.lyrics = 'new lyrics'
+        song.save()
+        self.assertEqual(Song.objects.get(id=song.id).lyrics, 'new lyrics')
+        song.lyrics = ''
+        song.save()
+        self.assertFalse(SongLyrics.objects.filter(song=song).exists())
+        self.assertIsNone(Song.objects.get(id=song.id).lyrics)
+
+    @override_settings(LYRICS_COMPRESSION=False)
+    def test_uncompressed(self, update_topic_vector):
+        song = Song.objects.create(song_title='Song', artist=self.artist, lyrics=self.lyrics)
+        song_lyrics = SongLyrics.objects.get(song=song)
+        self.assertFalse(song_lyrics.compressed)
+        self.assertEqual(song_lyrics.text, self.lyrics)
+
+
+# Search
+@mock.patch.object(Song, 'update_topic_vector', return_value=False)
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.artist = Artist.objects.create(name='Tyler, The Creator')
+        cls.album = Album.objects.create(album_title='Flower Boy', artist=cls.artist, genre='HipHop')
+        with mock.patch.object(Song, 'update_topic_vector', return_value=False):
+            cls.title_match = Song.objects.create(song_title='Garden Shed', artist=cls.artist, album=cls.album)
+            cls.lyrics_match = Song.objects.create(song_title='Boredom', artist=cls.artist, album=cls.album,
+                                                   lyrics='Find some time to ride through the garden')
+
+    def titles(self, query, **kwargs):
+        return [song.song_title for song in search.find_songs(query, **kwargs)]
+
+    def test_prefix_matching_every_word(self, update_topic_vector):
+        self.assertEqual(self.titles('gard'), ['Garden Shed'])
+        self.assertCountEqual(self.titles('tyl flow'), ['Boredom', 'Garden Shed'])
+        self.assertEqual(self.titles('tyler shed'), ['Garden Shed'])
+        self.assertEqual(self.titles('"garden" OR'), [])
+        # Too short to be a prefix
+        self.assertEqual(self.titles('ga'), [])
+        self.assertEqual(self.titles('  '), [])
+
+    def test_lyrics_only_when_asked_and_ranked_below_titles(self, update_topic_vector):
+        self.assertEqual(self.titles('ride'), [])
+        self.assertEqual(self.titles('ride', lyrics=True), ['Boredom'])
+        self.assertEqual(self.titles('garden', lyrics=True), ['Garden Shed', 'Boredom'])
+
+    def test_index_follows_catalog_changes(self, update_topic_vector):
+        self.artist.name = 'Ace Creator'
+        self.artist.save()
+        self.assertEqual(self.titles('tyl'), [])
+        self.assertEqual(len(self.titles('ace')), 2)
+
+        self.lyrics_match.lyrics = 'Rainy afternoon'
+        self.lyrics_match.save()
+        self.assertEqual(self.titles('rain', lyrics=True), ['Boredom'])
+
+        self.title_match.delete()
+        self.assertEqual(self.titles('garden', lyrics=True), [])
+
+    def test_limit(self, update_topic_vector):
+        self.assertEqual(len(self.titles('flower', limit=1)), 1)
+        self.assertEqual(len(self.titles('flower', limit=0)), 1)
+
+    def test_json_results(self, update_topic_vector):
+        response = self.client.get(reverse('search_songs'), {'q': 'garden she'})
+        self.assertEqual(response.json(), {'query': 'garden she', 'results': [{
+            'id': self.title_match.id, 'title': 'Garden Shed', 'artist': 'Tyler, The Creator', 'album': 'Flower Boy',
+            'album_id': self.album.id, 'genre': 'HipHop', 'url': reverse('song_lyrics', args=[self.title_match.id]),
+        }]})
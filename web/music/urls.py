@@ -2,7 +2,8 @@ from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import path
 from . import views
 from .views import album_detail, create_playlist, PlaylistDetailView, delete_playlist, signup, add_to_favorites, \
-    favorites_playlist, remove_from_favorites, remove_from_playlist, predict_song_topic, LyricsView
+    favorites_playlist, remove_from_favorites, remove_from_playlist, predict_song_topic, LyricsView, query_stats, \
+    search, search_songs
 
 urlpatterns = [
     # Index
@@ -11,6 +12,10 @@ urlpatterns = [
     # Album detail
     path('album/<int:pk>/', album_detail, name='album_detail'),
 
+    # Search page + JSON results
+    path('search/', search, name='search'),
+    path('search/songs/', search_songs, name='search_songs'),
+
     # Lyrics view
     path('songs/<int:song_id>/lyrics/', LyricsView.as_view(), name='song_lyrics'),
 
@@ -37,4 +42,7 @@ urlpatterns = [
 
     # Prediction
     path('predict_song_topic/', predict_song_topic, name='predict_song_topic'),
+
+    # Query instrumentation (staff, debug only)
+    path('debug/queries/', query_stats, name='query_stats'),
 ]
@@ -1,24 +1,21 @@
-from django.contrib import messages
 from django.contrib.auth import login
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.views import View
 from django.conf import settings
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from .models import Playlist, Album, Song
 from .forms import PlaylistForm, SignUpForm
-from itertools import groupby
-from operator import attrgetter
-from django.db.models import Q
+from .search import SEARCH_DEFAULT_LIMIT, find_songs
+from . import catalog, middleware
 
 
 # Index
 def index(request):
-    songs = Song.objects.all()
-    # Group albums by genre
-    albums = Album.objects.order_by('genre')
-    albums_by_genre = {}
-    for genre, albums_in_genre in groupby(albums, key=attrgetter('genre')):
-        albums_by_genre[genre] = list(albums_in_genre)
+    # Albums grouped by genre, cached until the catalog changes
+    albums_by_genre = catalog.albums_by_genre()
 
     # Check if the user is authenticated for playlists and recommendations
     playlists = None
@@ -26,25 +23,17 @@ def index(request):
     related_songs = []
 
     if request.user.is_authenticated:
-        playlists = Playlist.objects.filter(user=request.user)
-        favorites_exists = request.user.playlists.filter(name="Favorites").exists()
+        playlists = request.user_state.playlists
+        favorites_exists = request.user_state.favorites_id is not None
 
-        # If favorites do not exist, clear related_songs and reload the page
-        if not favorites_exists:
-            request.session.pop('related_songs', None)  # Clear related_songs
-            request.session.modified = True  # Mark session as modified
-
-        # Call the update_recommend_tab function to refresh recommendations
-        update_recommend_tab(request)  # Refresh recommendations based on favorites
-
-        related_songs = request.session.get('related_songs', [])
+        # Recommendations are derived data, read the last computed result
+        related_songs = user_recommendations(request.user)
 
     return render(request, 'music/index.html', {
         'albums_by_genre': albums_by_genre,
         'playlists': playlists,
         'favorites_exists': favorites_exists,
         'related_songs': related_songs,
-        'songs':songs,
     })
 
 
@@ -52,13 +41,14 @@ def index(request):
 # Lyrics view
 class LyricsView(View):
     def get(self, request, song_id):
-        song = get_object_or_404(Song, id=song_id)
-        return render(request, 'music/lyrics.html', {'song': song})  # Update with your actual template path
+        song = get_object_or_404(Song.objects.select_related('artist', 'album', 'lyrics_storage'), id=song_id)
+        # Neighbours are precomputed by `manage.py build_song_neighbours`
+        return render(request, 'music/lyrics.html', {'song': song, 'similar_songs': similar_songs(song)})  # Update with your actual template path
 
 
 # Album detail
 def album_detail(request, pk):
-    album = get_object_or_404(Album, pk=pk)
+    album = get_object_or_404(Album.objects.select_related('artist'), pk=pk)
     songs = album.songs.all()
 
     return render(request, 'music/album_detail.html', {'album': album, 'songs': songs})
@@ -77,12 +67,14 @@ def create_playlist(request):
     else:
         form = PlaylistForm()
 
-    # Prepare the list of songs with additional fields for display
-    songs_with_details = [{'song': song, 'song_title': song.song_title, 'artist': song.artist, 'album': song.album} for song in Song.objects.all()]
+    # Songs are found through the search endpoint; only those already picked are rendered again
+    selected_songs = []
+    if form.is_bound and form.cleaned_data.get('songs'):
+        selected_songs = form.cleaned_data['songs'].select_related('artist', 'album')
 
     return render(request, 'music/create_playlist.html', {
         'form': form,
-        'songs_with_details': songs_with_details
+        'selected_songs': selected_songs,
     })
 
 
@@ -90,7 +82,7 @@ def create_playlist(request):
 class PlaylistDetailView(View):
     def get(self, request, pk):
         playlist = get_object_or_404(Playlist, pk=pk)  # Get the playlist by its primary key
-        songs = playlist.songs.all()  # Get all songs related to this playlist
+        songs = playlist.songs.select_related('artist', 'album')  # Get all songs related to this playlist
         return render(request, 'music/playlist_detail.html', {'playlist': playlist, 'songs': songs})
 
 
@@ -110,33 +102,31 @@ def delete_playlist(request, pk):
 
 
 # Favourites
-def get_or_create_favorites_playlist(user):
-    playlist, created = Playlist.objects.get_or_create(name="Favorites", user=user)
-    return playlist
-
-
 @login_required
 def favorites_playlist(request):
-    favorites = get_object_or_404(Playlist, user=request.user, name="Favorites")
-    return render(request, 'music/favorites.html', {'playlist': favorites})
+    favorites = request.user_state.favorites
+    if favorites is None:
+        raise Http404("No Favorites playlist")
+    songs = favorites.songs.select_related('artist', 'album')
+    return render(request, 'music/favorites.html', {'playlist': favorites, 'songs': songs})
 
 
 # add fav
 @login_required
 def add_to_favorites(request, song_id):
     song = get_object_or_404(Song, id=song_id)
-    favorites_playlist = get_or_create_favorites_playlist(request.user)
+    favorites_playlist = request.user_state.favorites_playlist()
     favorites_playlist.songs.add(song)
 
     # Redirect back to the album detail page using pk
-    return redirect('album_detail', pk=song.album.id)
+    return redirect('album_detail', pk=song.album_id)
 
 
 # remove fav
 @login_required
 def remove_from_favorites(request, song_id):
     song = get_object_or_404(Song, id=song_id)
-    favorites_playlist = get_or_create_favorites_playlist(request.user)  # Assuming this function exists
+    favorites_playlist = request.user_state.favorites_playlist()
     favorites_playlist.songs.remove(song)  # Remove the song from the playlist
     return redirect('favorites_playlist')  # Redirect back to the favorites playlist page
 
@@ -153,69 +143,57 @@ def signup(request):
         form = SignUpForm()
     return render(request, 'music/signup.html', {'form': form})
 
-# update recommend
-from .model import predict_song_topic
-@login_required
-def update_recommend_tab(request):
-    favorites_playlist = get_or_create_favorites_playlist(request.user)
-
-    if favorites_playlist.songs.exists():
-        recommended_songs = []
-        liked_genres = set()  # Set to collect unique genres from liked songs
-
-        # Get genres from the fav songs
-        for song in favorites_playlist.songs.all():
-            liked_genres.add(song.genre)  # Collect the genre of the liked song
-
-            lyrics = song.lyrics
-            if lyrics:
-                top_topic, top_topic_probability, related_songs = predict_song_topic(lyrics)
-                recommended_songs.extend(related_songs)
-
-        # Use set to avoid dupes
-        unique_recommended_songs = set(recommended_songs)
-        print(f"\nUnique recommended songs: {unique_recommended_songs}")  # Debug
-
-        # Filter the recommended songs based on liked genres
-        filtered_recommended_songs = []
-        for item in unique_recommended_songs:
-            if len(item) == 3:  # Expecting (song_name, genre, probability)
-                song_name, genre, probability = item
-                if genre in liked_genres:  # Only keep songs with liked genres
-                    filtered_recommended_songs.append((song_name, genre))
-            else:
-                print(f"Unexpected item format in unique_recommended_songs: {item}")  # Debug
-
-        # Match fav song's genre to recommended song's genre
-        if not filtered_recommended_songs:
-            messages.info(request, "No recommendations found matching your liked genres.")
-            request.session.pop('related_songs', None)
-            request.session.modified = True  # Mark session as modified
-            return redirect('index')
+# Search
+def search_params(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        limit = SEARCH_DEFAULT_LIMIT
+    lyrics = request.GET.get('lyrics') in ('1', 'true', 'on')
+    return query, limit, lyrics
+
+
+def search(request):
+    query, limit, lyrics = search_params(request)
+    songs = find_songs(query, limit, lyrics) if query else []
+    return render(request, 'music/search.html', {'query': query, 'lyrics': lyrics, 'songs': songs})
+
+
+def search_songs(request):
+    query, limit, lyrics = search_params(request)
+    songs = find_songs(query, limit, lyrics) if query else []
+    return JsonResponse({
+        'query': query,
+        'results': [{
+            'id': song.id,
+            'title': song.song_title,
+            'artist': song.artist.name,
+            'album': song.album.album_title if song.album else None,
+            'album_id': song.album_id,
+            'genre': song.genre,
+            'url': reverse('song_lyrics', args=[song.id]),
+        } for song in songs],
+    })
 
-        # Query to get songs from database
-        song_queries = Q()
-        for song_name, genre in filtered_recommended_songs:
-            song_queries |= Q(song_title=song_name, genre=genre)
-        recommended_song_objects = Song.objects.filter(song_queries)
-
-        # Debug
-        for song in recommended_song_objects:
-            print(f"Song Title: {song.song_title}, Genre: {song.genre}, Duration: {song.duration}")
-
-        # Pass to template
-        request.session['related_songs'] = [
-            {
-                'song_title': song.song_title,
-                'album': song.album.album_title if song.album else None,
-                'artist': song.artist.name if song.artist else None,
-                'genre': song.genre,
-            } for song in recommended_song_objects
-        ]
 
-    else:
-        messages.info(request, "No liked songs found. Add songs to your favorites to see recommendations.")
-        request.session.pop('related_songs', None)
-        request.session.modified = True  # Mark session as modified
+# Query instrumentation (debug only, see QueryInstrumentationMiddleware)
+@staff_member_required
+def query_stats(request):
+    if not getattr(settings, 'QUERY_INSTRUMENTATION', settings.DEBUG):
+        raise Http404("Query instrumentation is off")
+    with middleware.query_stats_lock:
+        stats = [dict(view_stats, duplicates=sorted(view_stats['duplicates'].items(),
+                                                    key=lambda item: -item[1]['max_count']))
+                 for view_stats in middleware.query_stats.values()]
+    for view_stats in stats:
+        view_stats['avg_queries'] = view_stats['queries'] / view_stats['requests']
+        view_stats['avg_time_ms'] = view_stats['time_ms'] / view_stats['requests']
+    stats.sort(key=lambda view_stats: -view_stats['max_queries'])
+    return render(request, 'music/query_stats.html', {'stats': stats, 'song_cache': song_recommendations.stats()})
 
-    return redirect('index')
\ No newline at end of file
+
+# Recommendations
+from .model import predict_song_topic
+from .recommendations import song_recommendations, user_recommendations
+from .neighbours import similar_songs
@@ -26,6 +26,10 @@ SECRET_KEY = 'django-insecure-!=j9d5d#axidpkn8d(dk-efkf-@dl!rd+l9f%h(d3%^kwflc#e
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# Query count, SQL time and repeated queries of every request as X-Query-* headers
+# and per view on /debug/queries/ (see music.middleware.QueryInstrumentationMiddleware)
+QUERY_INSTRUMENTATION = DEBUG
+
 ALLOWED_HOSTS = []
 
 
@@ -42,11 +46,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'music.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'music.middleware.UserStateMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -132,3 +138,64 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Lyrics
+# Stored apart from songs (music.models.SongLyrics), zlib-compressed unless this
+# is off; each row records whether it is, so the setting can change at any time
+
+LYRICS_COMPRESSION = True
+
+
+# Search
+# Song search (music/search.py) indexes title, artist and album, and the lyrics
+# too unless this is off; run `manage.py rebuild_search_index` after changing it
+
+SEARCH_INDEX_LYRICS = True
+
+
+# Recommender
+# Build the pLSA recommender engine when the app loads instead of on first use
+
+RECOMMENDER_PRELOAD = False
+
+# build_recommender writes each build to music/models/releases and keeps this
+# many; running workers switch to a new release between requests
+
+RECOMMENDER_KEEP_RELEASES = 3
+
+# Catalogs with at least this many songs also get an approximate nearest
+# neighbour index (music/ann.py) for profile and similar-song lookups
+
+RECOMMENDER_ANN_MIN_ROWS = 50000
+
+# How new lyrics are mapped onto topics: "projection" (X @ P(w|z), renormalized)
+# or "fold_in" (EM over P(z|d) with P(w|z) fixed, capped at the given iterations)
+
+RECOMMENDER_INFERENCE = 'projection'
+RECOMMENDER_FOLD_IN_ITERATIONS = 20
+RECOMMENDER_FOLD_IN_TOL = 1e-4
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# "default" also holds the homepage catalog, keyed on a version bumped whenever an
+# album, artist or song changes. "recommendations" memoizes each song's related
+# songs; it evicts least recently used entries past MAX_ENTRIES. Any backend works;
+# with several worker processes use a shared one (e.g. Redis or Memcached) so that
+# a version bump in one process reaches the others.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recommendations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'song-recommendations',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}